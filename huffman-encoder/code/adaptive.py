@@ -0,0 +1,158 @@
+from bisect import bisect_left
+
+
+class AdaptiveNode:
+    __slots__ = ('weight', 'parent', 'left', 'right', 'symbol', 'index')
+
+    def __init__(self, symbol=None, parent=None, index=0):
+        self.weight = 0
+        self.parent = parent
+        self.left = None
+        self.right = None
+        self.symbol = symbol
+        self.index = index
+
+
+class AdaptiveModel:
+    # FGK adaptive Huffman tree over byte values. `order` lists the nodes
+    # from the highest node number (the root) down, so weights never
+    # increase along it (sibling property) and the NYT node is always last.
+    # unseen bytes are sent as the NYT code followed by the raw 8 bits
+    def __init__(self):
+        self.root = self.nyt = AdaptiveNode()
+        self.order = [self.root]
+        self.leaves = {}
+
+    def _leader(self, node, leaf=False):
+        # highest numbered node (or leaf) with the same weight as node
+        order = self.order
+        i = bisect_left(order, -node.weight, key=lambda n: -n.weight)
+        if leaf:
+            while order[i].left is not None:
+                i += 1
+        return order[i]
+
+    def _swap(self, a, b):
+        order = self.order
+        order[a.index], order[b.index] = b, a
+        a.index, b.index = b.index, a.index
+
+        pa, pb = a.parent, b.parent
+        if pa is pb:
+            pa.left, pa.right = pa.right, pa.left
+            return
+        if pa.left is a:
+            pa.left = b
+        else:
+            pa.right = b
+        if pb.left is b:
+            pb.left = a
+        else:
+            pb.right = a
+        a.parent, b.parent = pb, pa
+
+    def update(self, symbol):
+        node = self.leaves.get(symbol)
+        if node is None:
+            # the NYT node grows a new NYT (left) and the new leaf (right)
+            parent = self.nyt
+            node = AdaptiveNode(symbol, parent, len(self.order))
+            self.nyt = AdaptiveNode(None, parent, len(self.order) + 1)
+            parent.right, parent.left = node, self.nyt
+            self.order.extend((node, self.nyt))
+            self.leaves[symbol] = node
+
+        # the sibling of the NYT node weighs as much as its parent, so it
+        # only moves to the top of its block of leaves and is incremented
+        # once its ancestors are done, which keeps `order` sorted meanwhile
+        deferred = None
+        if node.parent is not None and node.parent is self.nyt.parent:
+            leader = self._leader(node, leaf=True)
+            if leader is not node:
+                self._swap(node, leader)
+            deferred, node = node, node.parent
+
+        while node is not None:
+            leader = self._leader(node)
+            if leader is not node and leader is not node.parent:
+                self._swap(node, leader)
+            node.weight += 1
+            node = node.parent
+
+        if deferred is not None:
+            deferred.weight += 1
+
+    @staticmethod
+    def code(node):
+        code, n = 0, 0
+        while node.parent is not None:
+            if node.parent.right is node:
+                code |= 1 << n
+            n += 1
+            node = node.parent
+        return code, n
+
+
+class AdaptiveHuffmanEncoder:
+    # one pass encoder: every record is encoded as soon as it arrives and
+    # the model is updated as it goes, no fit and no second pass. records
+    # come out byte aligned as (bytes, bit length) and must be decoded in
+    # the same order by an AdaptiveHuffmanDecoder
+    def __init__(self):
+        self._model = AdaptiveModel()
+
+    def encode(self, text):
+        model = self._model
+        acc, n_acc = 0, 0
+        for b in text.encode('utf-8'):
+            leaf = model.leaves.get(b)
+            if leaf is not None:
+                code, n = model.code(leaf)
+                acc = (acc << n) | code
+            else:
+                code, n = model.code(model.nyt)
+                acc = (((acc << n) | code) << 8) | b
+                n += 8
+            n_acc += n
+            model.update(b)
+
+        n_bytes = (n_acc + 7) // 8
+        return (acc << (n_bytes * 8 - n_acc)).to_bytes(n_bytes, 'big'), n_acc
+
+    def transform(self, data, *args, **kwargs):
+        for d in data:
+            yield self.encode(d)
+
+
+class AdaptiveHuffmanDecoder:
+    def __init__(self):
+        self._model = AdaptiveModel()
+
+    def decode(self, buf, n_bits):
+        model = self._model
+        decoded = bytearray()
+        pos = 0
+        while pos < n_bits:
+            node = model.root
+            while node.left is not None:
+                if pos >= n_bits:
+                    raise ValueError("Bitstream ends inside a code")
+                bit = (buf[pos >> 3] >> (7 - (pos & 7))) & 1
+                node = node.right if bit else node.left
+                pos += 1
+            if node is model.nyt:
+                if pos + 8 > n_bits:
+                    raise ValueError("Bitstream ends inside a literal")
+                b = 0
+                for _ in range(8):
+                    b = (b << 1) | ((buf[pos >> 3] >> (7 - (pos & 7))) & 1)
+                    pos += 1
+            else:
+                b = node.symbol
+            decoded.append(b)
+            model.update(b)
+        return decoded.decode('utf-8')
+
+    def inverse_transform(self, enc_data, *args, **kwargs):
+        for buf, n_bits in enc_data:
+            yield self.decode(buf, n_bits)
@@ -0,0 +1,130 @@
+import argparse
+import bz2
+import csv
+import json
+import os
+import platform
+import random
+import time
+import tracemalloc
+import zlib
+from string import ascii_lowercase
+
+from huffman import ModifiedHuffmanEncoder
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                      'receipt-item-classify', 'data', 'sample-1000.csv')
+
+
+def synthetic_corpus(n, vocab_size=2000, seed=0):
+    # receipt-like lines: a few words drawn from a zipf-ish vocabulary
+    rnd = random.Random(seed)
+    vocab = ["".join(rnd.choices(ascii_lowercase, k=rnd.randint(2, 9)))
+             for _ in range(vocab_size)]
+    weights = [1.0 / (i + 1) for i in range(vocab_size)]
+    return [" ".join(rnd.choices(vocab, weights=weights,
+                                 k=rnd.randint(1, 5)))
+            for _ in range(n)]
+
+
+def receipt_corpus(n, path=SAMPLE):
+    with open(path, mode='r') as stream:
+        rows = [r['product_text'].lower().strip()
+                for r in csv.DictReader(stream)]
+    return [rows[i % len(rows)] for i in range(n)]
+
+
+def run(fn, memory=True):
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def stage(seconds, peak, n_records, n_bytes):
+    return {"seconds": round(seconds, 6),
+            "records_per_s": round(n_records / seconds, 1) if seconds else None,
+            "mb_per_s": round(n_bytes / 1e6 / seconds, 3) if seconds else None,
+            "peak_bytes": peak}
+
+
+def bench_corpus(name, data, modes, memory=True):
+    raw = "\n".join(data).encode('utf-8')
+    n, n_bytes = len(data), len(raw)
+    report = {"corpus": name, "records": n, "raw_bytes": n_bytes,
+              "baselines": {}, "encoders": {}}
+
+    for codec, compress in (('zlib', zlib.compress), ('bz2', bz2.compress)):
+        packed, seconds, peak = run(lambda: compress(raw), memory)
+        report["baselines"][codec] = dict(
+            stage(seconds, peak, n, n_bytes), bytes=len(packed),
+            ratio=round(n_bytes / len(packed), 4))
+
+    for mode in modes:
+        enc = ModifiedHuffmanEncoder(mode=mode)
+        _, fit_s, fit_peak = run(lambda: enc.fit(data), memory)
+        (buf, bit_lengths), enc_s, enc_peak = run(
+            lambda: enc.transform_batch(data), memory)
+        decoded, dec_s, dec_peak = run(
+            lambda: list(enc.inverse_transform((buf, bit_lengths),
+                                               packed=True)), memory)
+        if decoded != [" ".join(d.split()) if mode == 'token' else d
+                       for d in data]:
+            raise AssertionError(f"{mode} round trip failed on {name}")
+
+        index_bytes = bit_lengths.itemsize * len(bit_lengths)
+        report["encoders"][mode] = {
+            "codebook_bytes": len(enc.codebook()),
+            "payload_bytes": len(buf),
+            "index_bytes": index_bytes,
+            "ratio": round(n_bytes / len(buf), 4) if buf else None,
+            "ratio_with_index": round(n_bytes / (len(buf) + index_bytes), 4),
+            "fit": stage(fit_s, fit_peak, n, n_bytes),
+            "encode": stage(enc_s, enc_peak, n, n_bytes),
+            "decode": stage(dec_s, dec_peak, n, n_bytes)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Huffman encoder throughput and compression benchmark")
+    parser.add_argument('--records', type=int, default=100000,
+                        help="records per corpus")
+    parser.add_argument('--modes', nargs='+', default=['char', 'token'])
+    parser.add_argument('--no-memory', action='store_true',
+                        help="skip the tracemalloc peak memory runs")
+    parser.add_argument('--out', default='bench_report.json')
+    args = parser.parse_args()
+
+    corpora = [('synthetic', synthetic_corpus(args.records))]
+    if os.path.isfile(SAMPLE):
+        corpora.append(('receipts', receipt_corpus(args.records)))
+
+    report = {"python": platform.python_version(),
+              "machine": platform.machine(),
+              "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+              "results": [bench_corpus(name, data, args.modes,
+                                       memory=not args.no_memory)
+                          for name, data in corpora]}
+    with open(args.out, mode='w') as stream:
+        json.dump(report, stream, indent=2)
+
+    for result in report["results"]:
+        for mode, r in result["encoders"].items():
+            print(f"{result['corpus']:>10} {mode:>5}  "
+                  f"ratio {r['ratio']:>6}  "
+                  f"encode {r['encode']['mb_per_s']:>8} MB/s  "
+                  f"decode {r['decode']['mb_per_s']:>8} MB/s")
+        for codec, r in result["baselines"].items():
+            print(f"{result['corpus']:>10} {codec:>5}  ratio {r['ratio']:>6}")
+    print(f"report written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
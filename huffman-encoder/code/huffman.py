@@ -1,45 +1,180 @@
+import codecs
 import heapq
-from collections import Counter
+import json
+import os
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter, deque
+from collections.abc import Collection, Mapping
+from itertools import islice
 from string import ascii_lowercase, digits, punctuation
 
+import numpy as np
+
 
 class HeapNode:
+    __slots__ = ('char', 'freq', 'left', 'right')
+
     def __init__(self, char, freq):
         self.char = char
         self.freq = freq
         self.left = None
         self.right = None
 
+    # heapq only ever compares HeapNodes with each other
     def __lt__(self, other):
-        if other is None:
-            return -1
-        if not isinstance(other, HeapNode):
-            return -1
-
         return self.freq < other.freq
 
     def __eq__(self, other):
-        if other is None:
-            return -1
-        if not isinstance(other, HeapNode):
-            return -1
-
         return self.freq == other.freq
 
     def __gt__(self, other):
-        if other is None:
-            return -1
-        if not isinstance(other, HeapNode):
-            return -1
         return self.freq > other.freq
 
 
+# header: magic, version, n_symbols, names size, mx_string, mode index.
+# version 1 was the HUF1 layout without the mode byte
+CODEBOOK_MAGIC = b'HUFC'
+CODEBOOK_VERSION = 2
+CODEBOOK_HEADER = struct.Struct('<4sHIIIB')
+# mx_string value stored for encoders whose widths were never measured
+UNMEASURED = 0xFFFFFFFF
+MODES = ('char', 'token')
+
+# symbol whose code announces a symbol missing from the alphabet, followed
+# by the symbol's utf-8 length in ESCAPE_BITS bits and its utf-8 bytes
+ESCAPE = ''
+ESCAPE_BITS = 16
+
+
+# codebook of the encoder used by a process pool worker, set once per
+# worker by _init_worker so shards only carry their strings
+_worker_encoder = None
+
+
+def _init_worker(codebook, tokenizer, joiner):
+    global _worker_encoder
+    _worker_encoder = ModifiedHuffmanEncoder.from_codebook(
+        codebook, tokenizer=tokenizer, joiner=joiner)
+
+
+def _encode_shard(shard, out, kwargs):
+    if out == 'codes':
+        return _worker_encoder.transform(shard, **kwargs)
+    return _worker_encoder.transform_batch(shard, out=out, **kwargs)
+
+
+class LookupDecoder:
+    # decodes a bitstream `bits` bits at a time. every table entry is
+    # (symbol, code length, sub table); codes longer than `bits` chain into
+    # a sub table indexed by the following `bits` bits
+    def __init__(self, inv_map, bits=8, joiner=""):
+        self.bits = bits
+        self.joiner = joiner
+        self._mask = (1 << bits) - 1
+        self.table = self._build_table(inv_map, bits)
+
+    @classmethod
+    def _build_table(cls, codes, bits):
+        table = [None] * (1 << bits)
+        long_codes = {}
+        for code, symbol in codes.items():
+            n = len(code)
+            if n <= bits:
+                base = int(code, 2) << (bits - n) if n else 0
+                entry = (symbol, n, None)
+                for idx in range(base, base + (1 << (bits - n))):
+                    table[idx] = entry
+            else:
+                long_codes.setdefault(code[:bits], {})[code[bits:]] = symbol
+
+        for prefix, sub_codes in long_codes.items():
+            table[int(prefix, 2)] = (None, bits,
+                                     cls._build_table(sub_codes, bits))
+        return table
+
+    def decode(self, buf, n_bits, bit_offset=0):
+        if n_bits == 0:
+            return ""
+        bits, mask, table = self.bits, self._mask, self.table
+        pos = bit_offset >> 3
+        end = (bit_offset + n_bits + 7) >> 3
+        n_acc = 8 - (bit_offset & 7)
+        acc = buf[pos] & ((1 << n_acc) - 1)
+        pos += 1
+
+        decoded = []
+        level = table
+        remaining = n_bits
+        while remaining > 0:
+            while n_acc < bits and pos < end:
+                acc = (acc << 8) | buf[pos]
+                pos += 1
+                n_acc += 8
+            entry = level[((acc << bits) >> n_acc) & mask]
+            if entry is None or entry[1] > remaining:
+                raise ValueError("Invalid code in bitstream")
+            symbol, length, sub_table = entry
+            n_acc -= length
+            acc &= (1 << n_acc) - 1
+            remaining -= length
+            if sub_table is not None:
+                level = sub_table
+                continue
+            if symbol == ESCAPE:
+                symbol, n_raw, acc, n_acc, pos = self._read_escape(
+                    buf, acc, n_acc, pos, end)
+                if n_raw > remaining:
+                    raise ValueError("Invalid code in bitstream")
+                remaining -= n_raw
+            decoded.append(symbol)
+            level = table
+
+        if level is not table:
+            raise ValueError("Bitstream ends inside a code")
+        return self.joiner.join(decoded)
+
+    @staticmethod
+    def _read_escape(buf, acc, n_acc, pos, end):
+        n_bytes = None
+        need = ESCAPE_BITS
+        while True:
+            while n_acc < need and pos < end:
+                acc = (acc << 8) | buf[pos]
+                pos += 1
+                n_acc += 8
+            if n_acc < need:
+                raise ValueError("Bitstream ends inside an escaped symbol")
+            value = acc >> (n_acc - need)
+            n_acc -= need
+            acc &= (1 << n_acc) - 1
+            if n_bytes is not None:
+                raw = value.to_bytes(n_bytes, 'big')
+                return (raw.decode('utf-8'), ESCAPE_BITS + need,
+                        acc, n_acc, pos)
+            n_bytes, need = value, 8 * value
+
+
 class ModifiedHuffmanEncoder:
-    def __init__(self):
+    def __init__(self, mode='char', tokenizer=None, joiner=None):
         super().__init__()
+        if mode not in MODES:
+            raise ValueError(f"Invalid mode {mode}. Must be one of {MODES}")
+        # 'char' codes single characters, 'token' codes the tokens returned
+        # by tokenizer (whitespace split by default) and joins them back
+        # together with joiner when decoding
+        self.mode = mode
+        self.tokenizer = tokenizer
+        self.joiner = (joiner if joiner is not None else
+                       "" if mode == 'char' else " ")
         self.heap = []
-        self.mx_string = 0
+        # widest encoded record in bits, None until records were measured
+        self.mx_string = None
         self._map, self._inv_map = {}, {}
+        self._decoders = {}
+        self._tables = None
+        self._counts = None
 
     # functions for compression:
     @staticmethod
@@ -48,18 +183,31 @@ class ModifiedHuffmanEncoder:
         all_strings = list(ascii_lowercase + digits + punctuation)
         count.update(all_strings)
         if type(strings) is list:
-            for s in strings:
-                chars = list(s)
-                count.update(chars)
+            for chunk in ModifiedHuffmanEncoder._chunks(strings, 65536):
+                ModifiedHuffmanEncoder._count_text("".join(chunk), count)
 
             return count
         elif type(strings) is str:
-            chars = list(strings)
-            count.update(chars)
+            ModifiedHuffmanEncoder._count_text(strings, count)
             return count
         else:
             raise TypeError("Invalid 'strings' value")
 
+    def token_frequencies(self, strings):
+        if type(strings) is str:
+            strings = [strings]
+        count = Counter()
+        for s in strings:
+            count.update(self._tokenize(s))
+        return count
+
+    def _tokenize(self, text):
+        if self.mode == 'char':
+            return text
+        tokens = (self.tokenizer(text) if self.tokenizer is not None
+                  else text.split())
+        return [t for t in tokens if t]
+
     def make_heap(self, frequency):
         for key in frequency:
             node1 = HeapNode(key, frequency[key])
@@ -75,29 +223,146 @@ class ModifiedHuffmanEncoder:
             heapq.heappush(self.heap, merged)
 
     def make_codes_helper(self, root, current_code):
-        if root is None:
-            return
+        stack = [(root, current_code)]
+        while stack:
+            node, code = stack.pop()
+            if node is None:
+                continue
 
-        if root.char is not None:
-            self._map[root.char] = current_code
-            self._inv_map[current_code] = root.char
-            return
+            if node.char is not None:
+                self._map[node.char] = code
+                self._inv_map[code] = node.char
+                continue
 
-        self.make_codes_helper(root.left, current_code + "0")
-        self.make_codes_helper(root.right, current_code + "1")
+            stack.append((node.right, code + "1"))
+            stack.append((node.left, code + "0"))
+
+    @staticmethod
+    def huffman_code_lengths(frequency):
+        # two queue construction over the leaves sorted by frequency: merged
+        # nodes are created in non decreasing frequency order, so the two
+        # lightest nodes are always at the front of one of the queues. the
+        # tree is kept as flat freq/parent arrays, leaves first, and code
+        # lengths are the node depths filled in from the root down
+        symbols = sorted(frequency, key=lambda k: (frequency[k], k))
+        n = len(symbols)
+        if n < 2:
+            return {k: 0 for k in symbols}
+
+        freq = [frequency[k] for k in symbols] + [0] * (n - 1)
+        parent = [0] * (2 * n - 1)
+        leaf, node = 0, n
+        for new in range(n, 2 * n - 1):
+            children = []
+            for _ in range(2):
+                if leaf < n and (node >= new or freq[leaf] <= freq[node]):
+                    children.append(leaf)
+                    leaf += 1
+                else:
+                    children.append(node)
+                    node += 1
+            freq[new] = freq[children[0]] + freq[children[1]]
+            parent[children[0]] = parent[children[1]] = new
+
+        depth = [0] * (2 * n - 1)
+        for i in range(2 * n - 3, -1, -1):
+            depth[i] = depth[parent[i]] + 1
+        return {symbols[i]: depth[i] for i in range(n)}
 
     def make_codes(self):
         root = heapq.heappop(self.heap)
         current_code = ""
         self.make_codes_helper(root, current_code)
+        self.set_code_lengths({k: len(v) for k, v in self._map.items()})
+
+    # canonical codes: only the code length of every symbol is needed to
+    # rebuild the codebook, codes are handed out in (length, symbol) order
+    @property
+    def code_lengths(self):
+        return {k: len(v) for k, v in self._map.items()}
+
+    def set_code_lengths(self, lengths):
+        self._map, self._inv_map = {}, {}
+        self._decoders = {}
+        self._tables = None
+        code, prev_len = 0, 0
+        for symbol, n in sorted(lengths.items(), key=lambda x: (x[1], x[0])):
+            code <<= n - prev_len
+            bit_string = format(code, 'b').zfill(n) if n else ""
+            self._map[symbol] = bit_string
+            self._inv_map[bit_string] = symbol
+            code += 1
+            prev_len = n
+
+    def codebook(self):
+        symbols = sorted(self._map, key=lambda x: (len(self._map[x]), x))
+        lengths = bytes(len(self._map[x]) for x in symbols)
+        names = json.dumps(symbols, ensure_ascii=False).encode('utf-8')
+        header = CODEBOOK_HEADER.pack(CODEBOOK_MAGIC, CODEBOOK_VERSION,
+                                      len(symbols), len(names),
+                                      UNMEASURED if self.mx_string is None
+                                      else self.mx_string,
+                                      MODES.index(self.mode))
+        return header + lengths + names
+
+    @classmethod
+    def from_codebook(cls, blob, tokenizer=None, joiner=None):
+        if bytes(blob[:4]) != CODEBOOK_MAGIC:
+            raise ValueError("Not a ModifiedHuffmanEncoder codebook")
+        magic, version, n_symbols, n_names, mx_string, mode = \
+            CODEBOOK_HEADER.unpack_from(blob)
+        if version != CODEBOOK_VERSION:
+            raise ValueError(f"Unsupported codebook version {version}")
+        if mode >= len(MODES):
+            raise ValueError(f"Invalid mode index {mode} in codebook")
+        start = CODEBOOK_HEADER.size
+        lengths = blob[start:start + n_symbols]
+        start += n_symbols
+        symbols = json.loads(bytes(blob[start:start + n_names])
+                             .decode('utf-8'))
+        enc = cls(mode=MODES[mode], tokenizer=tokenizer, joiner=joiner)
+        enc.set_code_lengths(dict(zip(symbols, lengths)))
+        enc.mx_string = None if mx_string == UNMEASURED else mx_string
+        return enc
+
+    def save(self, path):
+        with open(path, mode='wb') as stream:
+            stream.write(self.codebook())
+
+    @classmethod
+    def load(cls, path, tokenizer=None, joiner=None):
+        with open(path, mode='rb') as stream:
+            return cls.from_codebook(stream.read(), tokenizer=tokenizer,
+                                     joiner=joiner)
 
     def _encode(self, strings):
-        encoded_text = [self._map[character] for character in strings]
+        encoded_text = [self._map[character] if character in self._map
+                        else self._escape(character)
+                        for character in strings]
         return encoded_text
 
+    def _escape(self, symbol):
+        if ESCAPE not in self._map:
+            raise KeyError(symbol)
+        raw = symbol.encode('utf-8')
+        return (self._map[ESCAPE] + format(len(raw), '0%db' % ESCAPE_BITS) +
+                "".join(format(b, '08b') for b in raw))
+
+    def _unescape(self, code):
+        esc = self._map.get(ESCAPE)
+        if esc is None or not code.startswith(esc):
+            raise KeyError(code)
+        code = code[len(esc):]
+        n_bytes = int(code[:ESCAPE_BITS], 2)
+        raw = int(code[ESCAPE_BITS:], 2).to_bytes(n_bytes, 'big') \
+            if n_bytes else b""
+        return raw.decode('utf-8')
+
     def _decode(self, arr):
-        decoded_text = [self._inv_map[character] for character in arr]
-        return "".join(decoded_text)
+        decoded_text = [self._inv_map[character] if character in self._inv_map
+                        else self._unescape(character)
+                        for character in arr]
+        return self.joiner.join(decoded_text)
 
     @staticmethod
     def _generate_padding__(pad_size, pad_value='9'):
@@ -113,33 +378,371 @@ class ModifiedHuffmanEncoder:
     def _remove_padding__(encoded_array):
         return encoded_array[:-1]
 
+    @staticmethod
+    def _pack_bits__(bit_string):
+        n_bits = len(bit_string)
+        if n_bits == 0:
+            return b"", 0
+        n_bytes = (n_bits + 7) // 8
+        value = int(bit_string, 2) << (n_bytes * 8 - n_bits)
+        return value.to_bytes(n_bytes, 'big'), n_bits
+
+    def _transform_packed(self, data, aligned=True):
+        # aligned records start on a byte boundary so each one can be
+        # sliced out of the buffer from the running sum of its byte lengths;
+        # otherwise records are written back to back as one bitstream
+        buf = bytearray()
+        bit_lengths = array('I')
+        acc, n_acc = 0, 0
+        for d in data:
+            bit_string = "".join(self._encode(self._tokenize(d)))
+            n_bits = len(bit_string)
+            bit_lengths.append(n_bits)
+            if n_bits == 0:
+                continue
+            acc = (acc << n_bits) | int(bit_string, 2)
+            n_acc += n_bits
+            if aligned and n_acc % 8:
+                acc <<= 8 - n_acc % 8
+                n_acc += 8 - n_acc % 8
+            n_full = n_acc // 8
+            if n_full:
+                n_acc -= n_full * 8
+                buf.extend((acc >> n_acc).to_bytes(n_full, 'big'))
+                acc &= (1 << n_acc) - 1
+        if n_acc:
+            buf.extend((acc << (8 - n_acc)).to_bytes(1, 'big'))
+        return bytes(buf), bit_lengths
+
+    def decoder(self, bits=8):
+        if bits not in self._decoders:
+            self._decoders[bits] = LookupDecoder(self._inv_map, bits=bits,
+                                                 joiner=self.joiner)
+        return self._decoders[bits]
+
+    # vectorized batch encoding:
+    @staticmethod
+    def _chunks(data, size):
+        items = iter(data)
+        while True:
+            chunk = list(islice(items, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _code_tables(self):
+        # code values and code lengths indexed by code point
+        if self._tables is None:
+            chars = [c for c in self._map if len(c) == 1]
+            if any(len(self._map[c]) > 64 for c in chars):
+                raise ValueError("Batch encoding supports codes of up to "
+                                 "64 bits")
+            size = max(ord(c) for c in chars) + 1 if chars else 0
+            values = np.zeros(size, dtype=np.uint64)
+            lengths = np.zeros(size, dtype=np.int64)
+            for c in chars:
+                code = self._map[c]
+                values[ord(c)] = int(code, 2) if code else 0
+                lengths[ord(c)] = len(code)
+            self._tables = (values, lengths)
+        return self._tables
+
+    def _symbol_codes(self, data):
+        # -> code value and code length of every character, the offset of
+        # each record's first character and the bit length of each record
+        values, lengths = self._code_tables()
+        points = np.frombuffer("".join(data).encode('utf-32-le'),
+                               dtype=np.uint32)
+        sizes = np.fromiter(map(len, data), dtype=np.int64, count=len(data))
+        known = points < lengths.size
+        sym_lengths = np.zeros(points.size, dtype=np.int64)
+        sym_lengths[known] = lengths[points[known]]
+        missing = np.flatnonzero(sym_lengths == 0)
+        if missing.size:
+            raise KeyError(chr(points[missing[0]]))
+
+        starts = np.zeros(len(data) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=starts[1:])
+        bit_ends = np.zeros(points.size + 1, dtype=np.int64)
+        np.cumsum(sym_lengths, out=bit_ends[1:])
+        record_bits = bit_ends[starts[1:]] - bit_ends[starts[:-1]]
+        return values[points], sym_lengths, starts, record_bits
+
+    @staticmethod
+    def _pack_codes(codes, row_starts, n_bytes):
+        # packs every record into a zeroed byte buffer, record i starting at
+        # bit row_starts[i]. codes are shifted into place within 64 bit
+        # words, the part of a code spilling over a word boundary goes to
+        # the next word, and each word is OR-reduced over the codes it holds
+        sym_values, sym_lengths, starts, record_bits = codes
+        n_records = starts.size - 1
+        n_words = (n_bytes + 7) // 8 + 1
+        words = np.zeros(n_words, dtype=np.uint64)
+        if sym_lengths.size:
+            sym_record = np.repeat(np.arange(n_records), np.diff(starts))
+            bit_ends = np.zeros(sym_lengths.size + 1, dtype=np.int64)
+            np.cumsum(sym_lengths, out=bit_ends[1:])
+            sym_bit = bit_ends[:-1] + (row_starts - bit_ends[starts[:-1]])[
+                sym_record]
+
+            sym_word = sym_bit >> 6
+            end = (sym_bit & 63) + sym_lengths
+            spill = np.maximum(end - 64, 0)
+            head = (sym_values >> spill.astype(np.uint64)) << \
+                (64 - np.minimum(end, 64)).astype(np.uint64)
+            first = np.flatnonzero(np.diff(sym_word, prepend=-1))
+            words[sym_word[first]] |= np.bitwise_or.reduceat(head, first)
+
+            spilled = np.flatnonzero(spill)
+            words[sym_word[spilled] + 1] |= sym_values[spilled] << \
+                (64 - spill[spilled]).astype(np.uint64)
+        return words.astype('>u8').view(np.uint8)[:n_bytes]
+
+    def _batch_codes(self, chunk):
+        # None when the chunk has to go through the per record path: token
+        # mode, or characters outside the alphabet that need escaping
+        if self.mode != 'char':
+            return None
+        try:
+            return self._symbol_codes(chunk)
+        except KeyError:
+            if ESCAPE in self._map:
+                return None
+            raise
+
+    def _record_bits(self, chunk):
+        codes = self._batch_codes(chunk)
+        if codes is not None:
+            return codes[3]
+        return np.fromiter((len("".join(self._encode(self._tokenize(d))))
+                            for d in chunk), dtype=np.int64, count=len(chunk))
+
+    def _padded_width(self):
+        # padded output needs mx_string, which only fit() or finalize()
+        # with the records can measure
+        if self.mx_string is None:
+            raise ValueError("mx_string was never measured, padded output "
+                             "needs it. Use fit(), pass the records to "
+                             "finalize(text=...), or use packed output")
+        return self.mx_string
+
+    def transform_batch(self, data, *args, **kwargs):
+        out = kwargs.get("out", 'packed')
+        chunk_size = kwargs.get("chunk_size", 65536)
+        if out == 'packed':
+            buf = bytearray()
+            bit_lengths = array('I')
+            for chunk in self._chunks(data, chunk_size):
+                codes = self._batch_codes(chunk)
+                if codes is None:
+                    chunk_buf, chunk_lengths = self._transform_packed(chunk)
+                    buf.extend(chunk_buf)
+                    bit_lengths.extend(chunk_lengths)
+                    continue
+                record_bits = codes[3]
+                record_bytes = (record_bits + 7) // 8
+                row_starts = np.zeros(len(chunk), dtype=np.int64)
+                np.cumsum(record_bytes[:-1] * 8, out=row_starts[1:])
+                packed = self._pack_codes(codes, row_starts,
+                                          int(record_bytes.sum()))
+                buf.extend(packed.tobytes())
+                bit_lengths.frombytes(record_bits.astype(np.uint32).tobytes())
+            return bytes(buf), bit_lengths
+
+        elif out == 'bits':
+            # dense version of convert2binary(transform(data)); rows that
+            # do not fit in mx_string bits are dropped like in transform
+            width = self._padded_width()
+            row_bytes = (width + 7) // 8
+            pad_value = int(kwargs.get("pad_value", 9))
+            blocks = []
+            for chunk in self._chunks(data, chunk_size):
+                codes = self._batch_codes(chunk)
+                if codes is None:
+                    rows = self.convert2binary(self.transform(
+                        chunk, pad_value=pad_value))
+                    blocks.append(np.array(rows, dtype=np.int8)
+                                  .reshape(len(rows), width))
+                    continue
+                keep = np.flatnonzero(codes[3] <= width)
+                if keep.size < len(chunk):
+                    chunk = [chunk[i] for i in keep]
+                    codes = self._symbol_codes(chunk)
+                row_starts = np.arange(len(chunk), dtype=np.int64) * \
+                    row_bytes * 8
+                packed = self._pack_codes(codes, row_starts,
+                                          len(chunk) * row_bytes)
+                rows = np.unpackbits(packed.reshape(len(chunk), row_bytes),
+                                     axis=1)[:, :width].astype(np.int8)
+                rows[np.arange(width) >= codes[3][:, None]] = pad_value
+                blocks.append(rows)
+            if not blocks:
+                return np.zeros((0, width), dtype=np.int8)
+            return np.concatenate(blocks)
+        else:
+            raise ValueError("Invalid 'out' value. Must be 'packed' or 'bits'")
+
+    # functions for streaming fits:
+    @staticmethod
+    def _count_text(text, count):
+        points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        if not points.size:
+            return count
+        if points.max() < 256:
+            tally = np.bincount(points, minlength=256)
+            keys = np.flatnonzero(tally)
+            tally = tally[keys]
+        else:
+            keys, tally = np.unique(points, return_counts=True)
+        count.update(dict(zip(map(chr, keys.tolist()), tally.tolist())))
+        return count
+
+    @staticmethod
+    def _count_file(path, count, chunk_size):
+        # counts fixed size byte chunks; chunks holding non-ascii bytes go
+        # through an incremental utf-8 decoder so characters split across
+        # chunk boundaries are counted once
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        with open(path, mode='rb') as stream:
+            while True:
+                n = stream.readinto(buf)
+                if not n:
+                    break
+                tally = np.bincount(np.frombuffer(view[:n], dtype=np.uint8),
+                                    minlength=256)
+                if tally[128:].any():
+                    ModifiedHuffmanEncoder._count_text(
+                        decoder.decode(view[:n]), count)
+                else:
+                    keys = np.flatnonzero(tally)
+                    count.update(dict(zip(map(chr, keys.tolist()),
+                                          tally[keys].tolist())))
+        ModifiedHuffmanEncoder._count_text(decoder.decode(b"", final=True),
+                                           count)
+        # one record per line, line breaks are not part of the alphabet
+        for c in "\r\n":
+            count.pop(c, None)
+        return count
+
+    @staticmethod
+    def _is_path(source):
+        # files come as os.PathLike (e.g. pathlib.Path), a str is text as
+        # it is for fit()
+        return isinstance(source, os.PathLike)
+
+    def _records(self, data):
+        # the stripped records fit() would see for data
+        if isinstance(data, str):
+            data = data.strip()
+            return list(data) if self.mode == 'char' else [data]
+        return (t.strip() for t in data)
+
+    @classmethod
+    def count_frequencies(cls, source, chunk_size=1 << 20):
+        # raw character counts of an iterable of strings or an os.PathLike
+        # file with one record per line, e.g. for one shard of a parallel fit
+        count = Counter()
+        if cls._is_path(source):
+            return cls._count_file(source, count, chunk_size)
+        for chunk in cls._chunks(source, chunk_size):
+            cls._count_text("".join(chunk), count)
+        return count
+
+    @staticmethod
+    def merge_frequencies(*counts):
+        merged = Counter()
+        for count in counts:
+            merged.update(count)
+        return merged
+
+    def partial_fit(self, data, *args, **kwargs):
+        if self._counts is None:
+            self._counts = Counter(ascii_lowercase + digits + punctuation
+                                   if self.mode == 'char' else "")
+        if isinstance(data, Mapping):
+            self._counts.update(data)
+        elif self.mode == 'token':
+            if self._is_path(data):
+                with open(data, mode='r', encoding='utf-8') as stream:
+                    self._counts.update(self.token_frequencies(
+                        line.strip() for line in stream))
+            else:
+                self._counts.update(self.token_frequencies(
+                    self._records(data)))
+        elif self._is_path(data):
+            self._counts.update(self.count_frequencies(
+                data, kwargs.get("chunk_size", 1 << 20)))
+        else:
+            self._counts.update(self.count_frequencies(
+                self._records(data), kwargs.get("chunk_size", 1 << 20)))
+        return self
+
+    def fit_iter(self, source, *args, **kwargs):
+        chunk_size = kwargs.get("chunk_size", 1 << 20)
+        self._counts = None
+        self.partial_fit(source, chunk_size=chunk_size)
+        self.finalize()
+        # sized collections and files can be read a second time to find
+        # mx_string, one-shot iterators leave it unmeasured and padded
+        # output raises until finalize(text=...) is given the records
+        if self._is_path(source):
+            with open(source, mode='r', encoding='utf-8') as stream:
+                self._measure((line.strip() for line in stream), chunk_size)
+        elif isinstance(source, Collection):
+            self._measure(self._records(source), chunk_size)
+        return self
+
+    def finalize(self, text=None, chunk_size=65536):
+        self._build_codes(self._counts)
+        self.mx_string = None
+        if text is not None:
+            self._measure(text, chunk_size)
+        return self
+
+    def _build_codes(self, frequency):
+        self.heap = []
+        frequency = Counter(frequency)
+        frequency.setdefault(ESCAPE, 1)
+        self.set_code_lengths(self.huffman_code_lengths(frequency))
+
+    def _measure(self, text, chunk_size=65536):
+        self.mx_string = self.mx_string or 0
+        for chunk in self._chunks(text, chunk_size):
+            bit_lengths = self._record_bits(chunk)
+            self.mx_string = int(bit_lengths.max(initial=self.mx_string))
+
     def fit(self, data, *args, **kwargs):
         if type(data) is list:
             text = [t.strip() for t in data]
         else:
             text = data.strip()
 
-        frequency = self.frequencies(text)
-        self.make_heap(frequency)
-        self.merge_nodes()
-        self.make_codes()
+        if self.mode == 'char':
+            self._build_codes(self.frequencies(text))
+        else:
+            self._build_codes(self.token_frequencies(text))
 
-        for t in text:
-            chars = list(t)
-            enc_text = self._encode(chars)
-            if len("".join(enc_text)) > self.mx_string:
-                self.mx_string = len("".join(enc_text))
+        if type(text) is str:
+            text = list(text) if self.mode == 'char' else [text]
+        self._measure(text, kwargs.get("chunk_size", 65536))
 
     def transform(self, data, *args, **kwargs):
+        if kwargs.get("packed", False):
+            return self._transform_packed(data,
+                                          aligned=kwargs.get("aligned", True))
+
+        mx_string = self._padded_width()
         encoded = []
         for d in data:
-            chars = list(d)
+            chars = self._tokenize(d)
             enc_text = self._encode(chars)
             enc_string = "".join(enc_text)
-            if len(enc_string) > self.mx_string:
+            if len(enc_string) > mx_string:
                 pass
             else:
-                padding = ModifiedHuffmanEncoder._generate_padding__(pad_size=self.mx_string - len(enc_string),
+                padding = ModifiedHuffmanEncoder._generate_padding__(pad_size=mx_string - len(enc_string),
                                                                      pad_value=kwargs.get("pad_value", '9'))
                 if padding == "":
                     pass
@@ -151,6 +754,16 @@ class ModifiedHuffmanEncoder:
     def inverse_transform(self, enc_data, *args, **kwargs):
         has_pad = kwargs.get("has_pad", True)
 
+        if kwargs.get("packed", False):
+            buf, bit_lengths = enc_data
+            aligned = kwargs.get("aligned", True)
+            decoder = self.decoder(kwargs.get("table_bits", 8))
+            offset = 0
+            for n_bits in bit_lengths:
+                yield decoder.decode(buf, n_bits, bit_offset=offset)
+                offset += ((n_bits + 7) & ~7) if aligned else n_bits
+            return
+
         for row in enc_data:
             enc_row = (ModifiedHuffmanEncoder._remove_padding__(row) if
                        has_pad else row)
@@ -160,6 +773,55 @@ class ModifiedHuffmanEncoder:
         self.fit(data)
         return self.transform(data)
 
+    # functions for parallel encoding:
+    def iter_transform_parallel(self, data, *args, **kwargs):
+        # yields the encoded shards of `data` in input order. at most
+        # `max_pending` shards are in flight so memory stays flat no matter
+        # how long `data` is
+        out = kwargs.pop("out", 'packed')
+        workers = kwargs.pop("workers", None) or os.cpu_count() or 1
+        chunk_size = kwargs.pop("chunk_size", 65536)
+        max_pending = kwargs.pop("max_pending", 2 * workers)
+        if out != 'packed':
+            self._padded_width()
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(self.codebook(), self.tokenizer,
+                                           self.joiner)) as pool:
+            pending = deque()
+            for shard in self._chunks(data, chunk_size):
+                pending.append(pool.submit(_encode_shard, shard, out, kwargs))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def transform_parallel(self, data, *args, **kwargs):
+        out = kwargs.get("out", 'packed')
+        shards = self.iter_transform_parallel(data, **kwargs)
+        if out == 'packed':
+            # records are byte aligned so shards concatenate as they are
+            buf = bytearray()
+            bit_lengths = array('I')
+            for shard_buf, shard_lengths in shards:
+                buf.extend(shard_buf)
+                bit_lengths.extend(shard_lengths)
+            return bytes(buf), bit_lengths
+        elif out == 'bits':
+            blocks = list(shards)
+            if not blocks:
+                return np.zeros((0, self._padded_width()), dtype=np.int8)
+            return np.concatenate(blocks)
+        elif out == 'codes':
+            encoded = []
+            for shard in shards:
+                encoded.extend(shard)
+            return encoded
+        else:
+            raise ValueError("Invalid 'out' value. "
+                             "Must be 'packed', 'bits' or 'codes'")
+
     @classmethod
     def convert2binary(cls, arr):
         new_arr = []
@@ -0,0 +1,112 @@
+import mmap
+import struct
+
+import numpy as np
+
+from huffman import ModifiedHuffmanEncoder
+
+# file layout:
+#   header   magic, version, n_records, codebook size, bitstream size
+#   codebook ModifiedHuffmanEncoder.codebook()
+#   stream   byte aligned packed records, back to back
+#   index    n_records little endian uint64 bit offsets into the stream,
+#            then n_records uint32 bit lengths
+STORE_MAGIC = b'HUFS'
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct('<4sHQQQ')
+OFFSET = struct.Struct('<Q')
+LENGTH = struct.Struct('<I')
+
+
+class EncodedStore:
+    def __init__(self, path, tokenizer=None, joiner=None, table_bits=8):
+        self.path = path
+        self._file = open(path, mode='rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_records, n_codebook, n_stream = \
+            STORE_HEADER.unpack_from(self._mm)
+        if magic != STORE_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an encoded store")
+        if version != STORE_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported store version {version}")
+
+        start = STORE_HEADER.size
+        self.encoder = ModifiedHuffmanEncoder.from_codebook(
+            self._mm[start:start + n_codebook], tokenizer=tokenizer,
+            joiner=joiner)
+        self._decoder = self.encoder.decoder(table_bits)
+        start += n_codebook
+        self._stream = memoryview(self._mm)[start:start + n_stream]
+        self._offsets = start + n_stream
+        self._lengths = self._offsets + n_records * OFFSET.size
+        self._n = n_records
+
+    @classmethod
+    def write(cls, path, encoder, data, chunk_size=65536):
+        offsets, lengths = [], []
+        n_stream = 0
+        codebook = encoder.codebook()
+        with open(path, mode='wb') as stream:
+            stream.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, 0,
+                                           len(codebook), 0))
+            stream.write(codebook)
+            for chunk in encoder._chunks(data, chunk_size):
+                buf, bit_lengths = encoder.transform_batch(chunk)
+                bit_lengths = np.frombuffer(bit_lengths, dtype=np.uint32)
+                starts = np.zeros(bit_lengths.size, dtype=np.uint64)
+                np.cumsum(((bit_lengths[:-1] + 7) // 8 * 8)
+                          .astype(np.uint64), out=starts[1:])
+                offsets.append(starts + np.uint64(n_stream * 8))
+                lengths.append(bit_lengths)
+                stream.write(buf)
+                n_stream += len(buf)
+
+            n_records = sum(len(x) for x in lengths)
+            for arr, dtype in ((offsets, '<u8'), (lengths, '<u4')):
+                for part in arr:
+                    stream.write(part.astype(dtype).tobytes())
+            stream.seek(0)
+            stream.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION,
+                                           n_records, len(codebook),
+                                           n_stream))
+        return n_records
+
+    def bit_range(self, i):
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError("Record index out of range")
+        offset = OFFSET.unpack_from(self._mm,
+                                    self._offsets + i * OFFSET.size)[0]
+        n_bits = LENGTH.unpack_from(self._mm,
+                                    self._lengths + i * LENGTH.size)[0]
+        return offset, n_bits
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._n))]
+        offset, n_bits = self.bit_range(i)
+        return self._decoder.decode(self._stream, n_bits, bit_offset=offset)
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self[i]
+
+    def close(self):
+        if getattr(self, '_stream', None) is not None:
+            self._stream.release()
+            self._stream = None
+        if not self._mm.closed:
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
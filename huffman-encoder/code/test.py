@@ -15,3 +15,18 @@ print(binenc_vals)
 
 dec_vals = enc.inverse_transform(enc_vals)
 print(list(dec_vals))
+
+packed_vals = enc.transform(strings, packed=True)
+print(len(packed_vals[0]), list(packed_vals[1]))
+
+dec_packed = enc.inverse_transform(packed_vals, packed=True)
+print(list(dec_packed))
+
+batch_vals = enc.transform_batch(strings, out='bits')
+print(batch_vals)
+
+tok_enc = ModifiedHuffmanEncoder(mode='token')
+tok_enc.fit(strings)
+tok_vals = tok_enc.transform(strings + ['Wood Chuck!'], packed=True)
+print(len(tok_vals[0]), list(tok_vals[1]))
+print(list(tok_enc.inverse_transform(tok_vals, packed=True)))
@@ -0,0 +1,243 @@
+from collections import Counter
+
+import numpy as np
+
+
+def _indices(idx, n):
+    if isinstance(idx, slice):
+        return np.arange(n)[idx]
+    idx = np.asarray(idx)
+    if idx.dtype == bool:
+        return np.flatnonzero(idx)
+    return idx.astype(np.int64)
+
+
+class StringColumn:
+    # strings as one contiguous utf-8 buffer and n + 1 offsets into it, so
+    # take() gathers any subset with a few array operations
+    def __init__(self, values=()):
+        self.buffer = np.zeros(0, dtype=np.uint8)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.extend(values)
+
+    @classmethod
+    def _from_parts(cls, buffer, offsets):
+        col = cls()
+        col.buffer, col.offsets = buffer, offsets
+        return col
+
+    def extend(self, values):
+        encoded = [v.encode('utf-8') for v in values]
+        if not encoded:
+            return
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64,
+                              count=len(encoded))
+        offsets = self.offsets[-1] + np.cumsum(lengths)
+        self.buffer = np.concatenate(
+            [self.buffer, np.frombuffer(b"".join(encoded), dtype=np.uint8)])
+        self.offsets = np.concatenate([self.offsets, offsets])
+
+    def append(self, other):
+        self.buffer = np.concatenate([self.buffer, other.buffer])
+        self.offsets = np.concatenate(
+            [self.offsets, self.offsets[-1] + other.offsets[1:]])
+
+    def codepoints(self):
+        # -> (uint32 code points of all strings, n + 1 offsets in chars)
+        points = np.frombuffer(self.buffer.tobytes().decode('utf-8')
+                               .encode('utf-32-le'), dtype=np.uint32)
+        starts = np.zeros(self.buffer.size + 1, dtype=np.int64)
+        np.cumsum((self.buffer & 0xC0) != 0x80, out=starts[1:])
+        return points, starts[self.offsets]
+
+    @classmethod
+    def from_codepoints(cls, points, offsets):
+        points = np.asarray(points, dtype=np.uint32)
+        n_bytes = 1 + (points >= 0x80) + (points >= 0x800) + \
+            (points >= 0x10000)
+        starts = np.zeros(points.size + 1, dtype=np.int64)
+        np.cumsum(n_bytes, out=starts[1:])
+        buffer = np.frombuffer(points.tobytes().decode('utf-32-le')
+                               .encode('utf-8'), dtype=np.uint8)
+        return cls._from_parts(buffer, starts[np.asarray(offsets)])
+
+    def take(self, idx):
+        idx = _indices(idx, len(self))
+        starts = self.offsets[idx]
+        lengths = self.offsets[idx + 1] - starts
+        offsets = np.zeros(idx.size + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        gather = np.repeat(starts - offsets[:-1], lengths) + \
+            np.arange(offsets[-1])
+        return self._from_parts(self.buffer[gather], offsets)
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return self.offsets.size - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            n = len(self)
+            if i < 0:
+                i += n
+            if not 0 <= i < n:
+                raise IndexError("Column index out of range")
+            return self.buffer[self.offsets[i]:self.offsets[i + 1]] \
+                .tobytes().decode('utf-8')
+        return self.take(i)
+
+    def __iter__(self):
+        buf = self.buffer.tobytes()
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield buf[start:end].decode('utf-8')
+
+    def tolist(self):
+        return list(self)
+
+
+class CategoryColumn:
+    # values as integer codes into a list of distinct categories
+    def __init__(self, values=(), categories=None):
+        self.categories = list(categories or [])
+        self._index = {c: i for i, c in enumerate(self.categories)}
+        self.codes = np.zeros(0, dtype=np.int32)
+        self.extend(values)
+
+    def encode(self, values):
+        index, categories = self._index, self.categories
+        codes = []
+        for v in values:
+            code = index.get(v)
+            if code is None:
+                code = index[v] = len(categories)
+                categories.append(v)
+            codes.append(code)
+        return np.array(codes, dtype=np.int32)
+
+    def code(self, value):
+        return self._index.get(value, -1)
+
+    def extend(self, values):
+        codes = self.encode(values)
+        if codes.size:
+            self.codes = np.concatenate([self.codes, codes])
+
+    def append(self, other):
+        if other.categories == self.categories:
+            codes = other.codes
+        else:
+            codes = self.encode(other.categories)[other.codes]
+        self.codes = np.concatenate([self.codes, codes])
+
+    def take(self, idx):
+        col = CategoryColumn(categories=self.categories)
+        col.codes = self.codes[_indices(idx, len(self))]
+        return col
+
+    def counts(self):
+        counts = np.bincount(self.codes, minlength=len(self.categories))
+        return Counter({c: int(n) for c, n in zip(self.categories, counts)
+                        if n})
+
+    def __len__(self):
+        return self.codes.size
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            return self.categories[self.codes[i]]
+        return self.take(i)
+
+    def __iter__(self):
+        categories = self.categories
+        for code in self.codes.tolist():
+            yield categories[code]
+
+    def tolist(self):
+        return list(self)
+
+
+class ArrayColumn:
+    # numeric values in a plain ndarray
+    def __init__(self, values=(), dtype=np.int64):
+        self.values = np.asarray(list(values), dtype=dtype)
+
+    def extend(self, values):
+        self.values = np.concatenate(
+            [self.values, np.asarray(list(values), dtype=self.values.dtype)])
+
+    def append(self, other):
+        self.values = np.concatenate([self.values, other.values])
+
+    def take(self, idx):
+        col = ArrayColumn(dtype=self.values.dtype)
+        col.values = self.values[_indices(idx, len(self))]
+        return col
+
+    def __len__(self):
+        return self.values.size
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            return self.values[i].item()
+        return self.take(i)
+
+    def __iter__(self):
+        return iter(self.values.tolist())
+
+    def tolist(self):
+        return self.values.tolist()
+
+
+class Table:
+    # named columns of equal length. rows read back as lists in column
+    # order, like the old list of rows, but subsets are taken per column
+    def __init__(self, names=(), columns=()):
+        self.names = list(names)
+        self.columns = list(columns)
+
+    def add(self, name, column):
+        if self.columns and len(column) != len(self):
+            raise ValueError("Column %s has %d rows, expected %d" %
+                             (name, len(column), len(self)))
+        self.names.append(name)
+        self.columns.append(column)
+
+    def column(self, name):
+        return self.columns[self.names.index(name)]
+
+    def extend(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        if any(len(row) != len(self.columns) for row in rows):
+            raise ValueError("Rows must have %d values" % len(self.columns))
+        for col, values in zip(self.columns, zip(*rows)):
+            col.extend(values)
+
+    def append(self, other):
+        if other.names != self.names:
+            raise ValueError("Tables have different columns")
+        for col, more in zip(self.columns, other.columns):
+            col.append(more)
+
+    def take(self, idx):
+        idx = _indices(idx, len(self))
+        return Table(self.names, [col.take(idx) for col in self.columns])
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            return [col[i] for col in self.columns]
+        return self.take(i)
+
+    def __iter__(self):
+        for row in zip(*self.columns):
+            yield list(row)
+
+    def tolist(self):
+        return list(self)
@@ -1,12 +1,36 @@
 from receipts.enc import BaseEncoder
 from receipts import ENCODERS_DIR
 
+import hashlib
 import heapq
 import os
 import csv
+import json
+import struct
 from collections import Counter
+from itertools import islice
 from string import ascii_lowercase, digits, punctuation
 import numpy as np
+from scipy import sparse
+
+
+# header: magic, version, n_symbols, names size, mx_string, pad value
+CODEBOOK_MAGIC = b'HUFR'
+CODEBOOK_VERSION = 1
+CODEBOOK_HEADER = struct.Struct('<4sHIIIc')
+
+
+def _read_only(result):
+    # freezes the arrays of a transform() result in place
+    if isinstance(result, np.ndarray):
+        result.flags.writeable = False
+    elif sparse.issparse(result):
+        for arr in (result.data, result.indices, result.indptr):
+            arr.flags.writeable = False
+    elif isinstance(result, (list, tuple)):
+        for item in result:
+            _read_only(item)
+    return result
 
 
 class HeapNode:
@@ -70,8 +94,12 @@ class Encoder(BaseEncoder):
         super().__init__()
         self.heap = []
         self.mx_string = 0
-        self._encoded_training = []
+        self._training_text = []
         self.padding_arr = []
+        self.bucket_widths = []
+        self._tables = None
+        self._training_digest = None
+        self._training_cache = {}
     # functions for compression:
 
     def frequencies(self, strings):
@@ -122,40 +150,309 @@ class Encoder(BaseEncoder):
         root = heapq.heappop(self.heap)
         current_code = ""
         self.make_codes_helper(root, current_code)
+        self.set_code_lengths({k: len(v) for k, v in self._map.items()})
+
+    # canonical codes: the codebook is fully described by the code length
+    # of every symbol, codes are handed out in (length, symbol) order
+    @property
+    def code_lengths(self):
+        return {k: len(v) for k, v in self._map.items()}
+
+    def set_code_lengths(self, lengths):
+        self._map, self._inv_map = {}, {}
+        self._tables = None
+        self._training_cache = {}
+        code, prev_len = 0, 0
+        for symbol, n in sorted(lengths.items(), key=lambda x: (x[1], x[0])):
+            code <<= n - prev_len
+            bit_string = format(code, 'b').zfill(n) if n else ""
+            self._map[symbol] = bit_string
+            self._inv_map[bit_string] = symbol
+            code += 1
+            prev_len = n
+
+    def codebook(self):
+        symbols = sorted(self._map, key=lambda x: (len(self._map[x]), x))
+        lengths = bytes(len(self._map[x]) for x in symbols)
+        names = json.dumps(symbols, ensure_ascii=False).encode('utf-8')
+        pad_value = (self.padding_arr[0] if self.padding_arr else '9')
+        header = CODEBOOK_HEADER.pack(CODEBOOK_MAGIC, CODEBOOK_VERSION,
+                                      len(symbols), len(names),
+                                      self.mx_string,
+                                      pad_value.encode('ascii'))
+        return header + lengths + names
+
+    def load_codebook(self, blob):
+        if bytes(blob[:4]) != CODEBOOK_MAGIC:
+            raise ValueError("Not a receipts Huffman codebook")
+        magic, version, n_symbols, n_names, mx_string, pad_value = \
+            CODEBOOK_HEADER.unpack_from(blob)
+        if version != CODEBOOK_VERSION:
+            raise ValueError("Unsupported codebook version %d" % version)
+        start = CODEBOOK_HEADER.size
+        lengths = blob[start:start + n_symbols]
+        start += n_symbols
+        symbols = json.loads(bytes(blob[start:start + n_names])
+                             .decode('utf-8'))
+        self.set_code_lengths(dict(zip(symbols, lengths)))
+        self.mx_string = mx_string
+        self.padding_arr = self.generate_padding(pad_size=mx_string,
+                                                 pad_value=pad_value.decode())
+
+    def load(self, name):
+        pth = os.path.join(ENCODERS_DIR, f'{name}_codebook.huf')
+        if os.path.isfile(pth):
+            with open(pth, mode='rb') as stream:
+                self.load_codebook(stream.read())
+            print("Loaded.")
+            return True
+        else:
+            return False
+
+    def dump(self, name):
+        pth = os.path.join(ENCODERS_DIR, f'{name}_codebook.huf')
+        with open(pth, mode='wb') as stream:
+            stream.write(self.codebook())
+        print("Saved.")
 
     def _encode(self, strings):
         encoded_text = [self._map[character] for character in strings]
         return encoded_text
 
+    # vectorized encoding: every character is looked up in code value and
+    # code length arrays indexed by code point, codes are OR-ed into 64 bit
+    # words and each row of the output is a fixed number of bytes
+    @staticmethod
+    def _chunks(data, size):
+        items = iter(data)
+        while True:
+            chunk = list(islice(items, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _code_tables(self):
+        if self._tables is None:
+            chars = [c for c in self._map if len(c) == 1]
+            if any(len(self._map[c]) > 64 for c in chars):
+                raise ValueError("Codes longer than 64 bits not supported")
+            size = max(ord(c) for c in chars) + 1 if chars else 0
+            values = np.zeros(size, dtype=np.uint64)
+            lengths = np.zeros(size, dtype=np.int64)
+            for c in chars:
+                code = self._map[c]
+                values[ord(c)] = int(code, 2) if code else 0
+                lengths[ord(c)] = len(code)
+            self._tables = (values, lengths)
+        return self._tables
+
+    def _symbol_codes(self, data):
+        values, lengths = self._code_tables()
+        points = np.frombuffer("".join(data).encode('utf-32-le'),
+                               dtype=np.uint32)
+        sizes = np.fromiter(map(len, data), dtype=np.int64, count=len(data))
+        known = points < lengths.size
+        sym_lengths = np.zeros(points.size, dtype=np.int64)
+        sym_lengths[known] = lengths[points[known]]
+        missing = np.flatnonzero(sym_lengths == 0)
+        if missing.size:
+            raise KeyError(chr(points[missing[0]]))
+
+        starts = np.zeros(len(data) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=starts[1:])
+        bit_ends = np.zeros(points.size + 1, dtype=np.int64)
+        np.cumsum(sym_lengths, out=bit_ends[1:])
+        record_bits = bit_ends[starts[1:]] - bit_ends[starts[:-1]]
+        return values[points], sym_lengths, starts, bit_ends, record_bits
+
+    def _bit_lengths(self, data):
+        return self._symbol_codes(data)[4]
+
+    @staticmethod
+    def _pack_rows(codes, row_bytes):
+        # -> (n_rows, row_bytes) uint8, every row's code bits from bit 0 on
+        sym_values, sym_lengths, starts, bit_ends, record_bits = codes
+        n_rows = starts.size - 1
+        row_words = (row_bytes + 7) // 8
+        words = np.zeros(n_rows * row_words + 1, dtype=np.uint64)
+        if sym_lengths.size:
+            sym_row = np.repeat(np.arange(n_rows), np.diff(starts))
+            sym_bit = bit_ends[:-1] - bit_ends[starts[:-1]][sym_row] + \
+                sym_row * row_words * 64
+
+            sym_word = sym_bit >> 6
+            end = (sym_bit & 63) + sym_lengths
+            spill = np.maximum(end - 64, 0)
+            head = (sym_values >> spill.astype(np.uint64)) << \
+                (64 - np.minimum(end, 64)).astype(np.uint64)
+            first = np.flatnonzero(np.diff(sym_word, prepend=-1))
+            words[sym_word[first]] |= np.bitwise_or.reduceat(head, first)
+
+            spilled = np.flatnonzero(spill)
+            words[sym_word[spilled] + 1] |= sym_values[spilled] << \
+                (64 - spill[spilled]).astype(np.uint64)
+        rows = words[:-1].astype('>u8').view(np.uint8)
+        return rows.reshape(n_rows, row_words * 8)[:, :row_bytes]
+
+    def _transform_chunk(self, chunk, out, pad_value, width):
+        codes = self._symbol_codes(chunk)
+        keep = np.flatnonzero(codes[4] <= width)
+        if keep.size < len(chunk):
+            chunk = [chunk[i] for i in keep]
+            codes = self._symbol_codes(chunk)
+
+        packed = self._pack_rows(codes, (width + 7) // 8)
+        if out == 'packed':
+            return packed
+        bits = np.unpackbits(packed, axis=1, count=width).astype(np.int8)
+        if out == 'csr':
+            return sparse.csr_matrix(bits)
+        bits[np.arange(width) >= codes[4][:, None]] = pad_value
+        return bits
+
+    def _encode_rows(self, data, out, pad_value, width, chunk_size):
+        blocks = [self._transform_chunk(chunk, out, pad_value, width)
+                  for chunk in self._chunks(data, chunk_size)]
+        if out == 'csr':
+            if not blocks:
+                return sparse.csr_matrix((0, width), dtype=np.int8)
+            return sparse.vstack(blocks, format='csr')
+
+        if blocks:
+            items = np.concatenate(blocks)
+        elif out == 'packed':
+            items = np.zeros((0, (width + 7) // 8), dtype=np.uint8)
+        else:
+            items = np.zeros((0, width), dtype=np.int8)
+        if out in ('dense', 'packed'):
+            return items
+        return np.matrix(items, dtype=int)
+
+    def _encode_ragged(self, data, chunk_size):
+        # every row's code bits back to back; row i is
+        # values[offsets[i]:offsets[i + 1]]
+        values, lengths = [], []
+        for chunk in self._chunks(data, chunk_size):
+            codes = self._symbol_codes(chunk)
+            record_bits = codes[4]
+            width = int(record_bits.max(initial=0))
+            packed = self._pack_rows(codes, (width + 7) // 8)
+            bits = np.unpackbits(packed, axis=1, count=width)
+            values.append(bits[np.arange(width) < record_bits[:, None]]
+                          .astype(np.int8))
+            lengths.append(record_bits)
+        offsets = np.zeros(sum(x.size for x in lengths) + 1, dtype=np.int64)
+        if lengths:
+            np.cumsum(np.concatenate(lengths), out=offsets[1:])
+            return np.concatenate(values), offsets
+        return np.zeros(0, dtype=np.int8), offsets
+
+    def _encode_bucketed(self, data, out, pad_value, chunk_size):
+        # every row goes to the narrowest width class that holds it, rows
+        # longer than the widest class get an overflow class of their own
+        # instead of being dropped. -> [(width, row indices, rows), ...]
+        data = list(data)
+        bits = np.concatenate([self._bit_lengths(chunk) for chunk in
+                               self._chunks(data, chunk_size)] or
+                              [np.zeros(0, dtype=np.int64)])
+        widths = list(self.bucket_widths or [self.mx_string])
+        longest = int(bits.max(initial=0))
+        if longest > widths[-1]:
+            widths.append((longest + 7) // 8 * 8)
+
+        bucket = np.searchsorted(np.asarray(widths), bits)
+        buckets = []
+        for b, width in enumerate(widths):
+            rows = np.flatnonzero(bucket == b)
+            if not rows.size:
+                continue
+            buckets.append((width, rows, self._encode_rows(
+                [data[i] for i in rows], out, pad_value, width, chunk_size)))
+        return buckets
+
     def transform(self, data, *args, **kwargs):
+        # out: 'dense' (n_rows, mx_string) int8 ndarray of code bits and
+        # padding, 'packed' the same bits 8 to a byte without padding,
+        # 'csr' a scipy.sparse matrix of the set bits, anything else the
+        # dense values as an np.matrix as before.
+        # layout: 'fixed' pads every row to mx_string and leaves out longer
+        # rows, 'bucketed' splits rows into width classes (see
+        # _encode_bucketed), 'ragged' returns (values, offsets) without
+        # any padding
         out = kwargs.get("out", int)
         oper = kwargs.get("oper", 'testing')
-        items = []
-        _encoded_test = []
+        layout = kwargs.get("layout", 'fixed')
+        chunk_size = kwargs.get("chunk_size", 65536)
+        pad_value = int(self.padding_arr[0]) if self.padding_arr else 9
         if oper == 'training':
-            for e in self._encoded_training:
-                string = "".join(e)
-                string_pad_size = self.mx_string - len(string)
-                
-                int_arr = [int(x) for x in 
-                           list(string)+self.padding_arr[:string_pad_size]]
-                items.append(np.asarray(int_arr))
+            if kwargs.get("cache", True):
+                return self._cached_training(out, layout, pad_value,
+                                             chunk_size,
+                                             kwargs.get("persist", False))
+            data = self._training_text
+
+        if layout == 'fixed':
+            return self._encode_rows(data, out, pad_value, self.mx_string,
+                                     chunk_size)
+        elif layout == 'bucketed':
+            return self._encode_bucketed(data, out, pad_value, chunk_size)
+        elif layout == 'ragged':
+            return self._encode_ragged(data, chunk_size)
         else:
-            for d in data:
-                chars = list(d)
-                enc_text = self._encode(chars)
-                string = "".join(enc_text)
-                if len("".join(enc_text)) > self.mx_string:
-                    pass
+            raise ValueError("Invalid layout. "
+                             "Must be 'fixed', 'bucketed' or 'ragged'")
+
+    # training encodings only change when the codebook or the training text
+    # do, so they are computed once per (out, layout) and reused. with
+    # persist=True fixed layout arrays are also kept as .npy files under
+    # ENCODERS_DIR, named after the codebook and training text hash
+    def training_key(self):
+        digest = hashlib.sha1(self.codebook())
+        digest.update((self._training_digest or '').encode('ascii'))
+        return digest.hexdigest()[:16]
+
+    def _cached_training(self, out, layout, pad_value, chunk_size, persist):
+        key = (str(out), layout)
+        result = self._training_cache.get(key)
+        pth = None
+        if persist and layout == 'fixed' and out != 'csr':
+            kind = ('packed' if out == 'packed' else 'dense')
+            pth = os.path.join(ENCODERS_DIR, 'training_%s_%s.npy' %
+                               (self.training_key(), kind))
+
+        if result is None:
+            if pth is not None:
+                if os.path.isfile(pth):
+                    items = np.load(pth)
                 else:
-                    _encoded_test.append(enc_text)
-                    
-                    string_pad_size = self.mx_string - len(string)
-                    int_arr = [int(x) for x in 
-                               list(string)+self.padding_arr[:string_pad_size]]
-                    items.append(np.asarray(int_arr))
-                    
-        return np.matrix(items)
+                    items = self._encode_rows(self._training_text, kind,
+                                              pad_value, self.mx_string,
+                                              chunk_size)
+                result = (items if out == kind else
+                          np.matrix(items, dtype=int))
+            else:
+                result = self.transform(self._training_text, out=out,
+                                        layout=layout, chunk_size=chunk_size)
+            # every caller gets the same arrays, so nobody may edit them
+            self._training_cache[key] = result = _read_only(result)
+        # an earlier in-memory hit still has to reach disk
+        if pth is not None and not os.path.isfile(pth):
+            np.save(pth, result if out == kind else
+                    np.asarray(result, dtype=np.int8))
+        return result
+
+    def clear_cache(self):
+        self._training_cache = {}
+
+    @staticmethod
+    def width_classes(bits, n_buckets, max_width):
+        # byte rounded bit length quantiles of the training rows, the widest
+        # class is always max_width
+        if not bits.size:
+            return [max_width]
+        qs = np.quantile(bits, np.linspace(0, 1, n_buckets + 1)[1:-1])
+        widths = sorted(set(int(w + 7) // 8 * 8 for w in qs))
+        return [w for w in widths if w < max_width] + [max_width]
 
     def generate_padding(self, pad_size, pad_value='9'):
         if pad_size == 'auto':
@@ -179,12 +476,19 @@ class Encoder(BaseEncoder):
         self.merge_nodes()
         self.make_codes()
         
-        for t in text:
-            chars = list(t)
-            enc_text = self._encode(chars)
-            self._encoded_training.append(enc_text)
-            if len("".join(enc_text)) > self.mx_string + add_pad:
-                self.mx_string = len("".join(enc_text)) + add_pad
+        self._training_text = list(text)
+        self._training_cache = {}
+        digest = hashlib.sha1()
+        for chunk in self._chunks(self._training_text, 65536):
+            digest.update("\n".join(chunk).encode('utf-8'))
+            digest.update(b"\n")
+        self._training_digest = digest.hexdigest()
+        bits = np.concatenate([self._bit_lengths(chunk) for chunk in
+                               self._chunks(self._training_text, 65536)] or
+                              [np.zeros(0, dtype=np.int64)])
+        self.mx_string = max(self.mx_string, int(bits.max(initial=0)) + add_pad)
+        self.bucket_widths = self.width_classes(
+            bits, kwargs.get("n_buckets", 4), self.mx_string)
         self.padding_arr = self.generate_padding(pad_size=self.mx_string,
                                                  pad_value=pad_value)
 
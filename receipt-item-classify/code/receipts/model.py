@@ -1,4 +1,5 @@
-from collections import Counter
+from collections import Counter, deque
+import numpy as np
 
 
 def merge_predicted(rule_pred, other_pred):
@@ -9,13 +10,59 @@ def merge_predicted(rule_pred, other_pred):
     return [o[1] for o in ordered]
 
 
+class RuleMatcher:
+    # Aho-Corasick automaton over the rules, with the failure links folded
+    # into each state's transitions, so a string is scanned once, one dict
+    # lookup per char, however many rules there are
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        goto, final = [{}], [False]
+        for rule in self.rules:
+            state = 0
+            for c in rule:
+                nxt = goto[state].get(c)
+                if nxt is None:
+                    nxt = goto[state][c] = len(goto)
+                    goto.append({})
+                    final.append(False)
+                state = nxt
+            final[state] = True
+
+        # breadth first, so a state's failure target is always done first
+        fail = [0] * len(goto)
+        delta = [None] * len(goto)
+        delta[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            delta[state] = dict(delta[fail[state]])
+            delta[state].update(goto[state])
+            final[state] = final[state] or final[fail[state]]
+            for c, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(c, 0) if state else 0
+                queue.append(nxt)
+        self._delta, self._final = delta, final
+
+    def search(self, x):
+        # True if any rule occurs in x
+        delta, final = self._delta, self._final
+        if final[0]:
+            return True
+        state = 0
+        for c in x:
+            state = delta[state].get(c, 0)
+            if final[state]:
+                return True
+        return False
+
+
 class RuleModel:
 
     def __init__(self, target_cls, *args, **kwargs):
         self._X, self._y = [], []
         self._predicted = []
         self._target_cls = target_cls
-        self._rules = {}
+        self._rules, self._matcher = {}, RuleMatcher(())
         self._fpr_threshold = kwargs.get('fpr_threshold', [.0, .10])
         self._max_n, self._min_n = kwargs.get("max_n", 50), kwargs.get("min_n", 5)
         self._max_chnk = kwargs.get("max_chunk_sz", 30)
@@ -28,6 +75,12 @@ class RuleModel:
     @property
     def rules(self):
         return self._rules
+
+    @rules.setter
+    def rules(self, rules):
+        # the matcher is rebuilt here, once per change of rules
+        self._rules = rules
+        self._matcher = RuleMatcher(rules)
     
     @property
     def target_class(self):
@@ -67,14 +120,35 @@ class RuleModel:
         return sorted([(k, cnts[k]) for k in cnts if len(k) == substring_size], 
                       key=lambda x: x[1], reverse=(True if freq=='most' else False))
     
+    def _matcher_for__(self, rs):
+        # the model's own rules use the matcher built when they were set,
+        # any other rule set gets a matcher of its own
+        if rs is None or rs is self._rules:
+            return self._matcher
+        return RuleMatcher(rs)
+
+    @staticmethod
+    def _check_row__(x, matcher):
+        # any rule in x without spaces, or x all digits, once there are rules
+        if not matcher.rules:
+            return False
+        return x.isdigit() or matcher.search(x.replace(" ", ""))
+
     def _check_rules__(self, x, rs):
-        val = False
-        for rule in rs:
-            if rule in x.replace(" ", ""):
-                val = True
-            elif x.isdigit():
-                val = True
-        return val
+        return self._check_row__(x, self._matcher_for__(rs))
+
+    def match(self, X, rs=None):
+        # _check_rules__ over a whole array of strings with one matcher,
+        # each distinct string checked once
+        matcher = self._matcher_for__(rs)
+        seen = {}
+        hits = np.zeros(len(X), dtype=bool)
+        for i, x in enumerate(X):
+            hit = seen.get(x)
+            if hit is None:
+                hit = seen[x] = self._check_row__(x, matcher)
+            hits[i] = hit
+        return hits
     
     def _update_rules__(self, existing, new, exclude, n):
         existing = [e for e in existing if e not in exclude]
@@ -95,8 +169,9 @@ class RuleModel:
         
         _fn_tups, _fp_tups, _tn_tups, _tp_tups = [], [], [], []
         _neg_classes = []
+        hits = self.match(X, rules)
         for _idx in range(len(X)):
-            if self._check_rules__(X[_idx], rules):
+            if hits[_idx]:
                 if self._verify_class__(y[_idx]):
                     _tp_tups.insert(len(_tp_tups), (_idx, X[_idx]))
                 else:
@@ -158,7 +233,7 @@ class RuleModel:
         if thfpr:
             self._X = X
             self._y = y
-            self._rules = rules
+            self.rules = rules
         else:
             
             model_params = {"X": X, 'y': y, "n": n, 'chnk_size': chnk_size, 
@@ -171,7 +246,7 @@ class RuleModel:
                     print("Hit limit no further optimization is possible")
                     self._X = X
                     self._y = y
-                    self._rules = rules
+                    self.rules = rules
                 else:
                     chnk_size += chgmag['chnk']
                     model_params.update({"chnk_size": chnk_size,
@@ -196,13 +271,12 @@ class RuleModel:
                     print("Hit limit no further optimization is possible")
                     self._X = X
                     self._y = y
-                    self._rules = rules
+                    self.rules = rules
 
     def predict(self, X, **kwargs):
-        for tx in range(len(X)):
-            if self._check_rules__(X[tx], self.rules):
-                self._predicted.append((tx, self.target_class))
-            else:
-                self._predicted.append((tx, None))
+        hits = self.match(X)
+        labels = [self.target_class if h else None for h in hits.tolist()]
+        self._predicted.extend(enumerate(labels))
+        return labels
 
         # print(f"{len(self._predicted)} not an item cases identified by rule model")
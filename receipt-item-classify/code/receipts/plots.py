@@ -1,31 +1,68 @@
 from receipts import PLOTS_DIR
-from receipts.preproc import Utils, Counter
+from receipts.preproc import CounterEngine, Counter
 
+import hashlib
+import json
 import os
-from plotly import io
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from plotly import io, __version__ as plotly_version
+from plotly.offline import get_plotlyjs
+from plotly.utils import PlotlyJSONEncoder
 import chart_studio.plotly as ply
 from plotly import graph_objs as go
 from plotly.subplots import make_subplots
 
 
 class DataExploration(object):
-    
+    # counters per dataset, least recently used first. a dataset is keyed
+    # by its identity, length and a sample of its rows, so rows edited in
+    # place need an explicit invalidate()
+    cache_size = 8
+    _cache = OrderedDict()
+
+    @staticmethod
+    def fingerprint(x):
+        step = max(1, len(x) // 1024)
+        digest = hashlib.sha1(str(len(x)).encode('utf-8'))
+        for d in x[::step]:
+            digest.update(repr(sorted(d.items())).encode('utf-8'))
+        return id(x), digest.hexdigest()
+
     @classmethod
-    def data(cls, x, grp, top_n=None):
-        cx = Utils.counters(x, top_n=top_n)
-        
-        valid = ['Product Text (Parts)', 'Product Text (Split)', 
-                 'Product Text (Chars)', "Retailers", 'Categories']
-        
-        try:
-            data_idx = cx['name_idx'].index(grp)
-        except KeyError:
-            raise KeyError(f"Invalid group name {grp}. Not found in {valid}")
+    def invalidate(cls, x=None):
+        if x is None:
+            cls._cache.clear()
         else:
-            counter = cx['counters'][data_idx]
-            data_lst = counter['data']
-            data_cnts = counter['counts']
-            data_freqs = counter['frequencies']
+            cls._cache.pop(cls.fingerprint(x), None)
+
+    @classmethod
+    def counter(cls, x, grp, top_n=None):
+        # only grp is counted, the first time it is asked for on x
+        if grp not in CounterEngine.NAMES:
+            raise KeyError(f"Invalid group name {grp}. "
+                           f"Not found in {CounterEngine.NAMES}")
+        key = cls.fingerprint(x)
+        entry = cls._cache.pop(key, None)
+        if entry is None:
+            entry = {'engine': CounterEngine([grp]).update(x), 'results': {}}
+        elif grp not in entry['engine'].counters:
+            entry['engine'].merge(CounterEngine([grp]).update(x))
+        cls._cache[key] = entry
+        while len(cls._cache) > cls.cache_size:
+            cls._cache.popitem(last=False)
+
+        results = entry['results']
+        if (grp, top_n) not in results:
+            results[grp, top_n] = entry['engine'].result(grp, top_n=top_n)
+        return results[grp, top_n]
+
+    @classmethod
+    def data(cls, x, grp, top_n=None):
+        counter = cls.counter(x, grp, top_n=top_n)
+        data_lst = counter['data']
+        data_cnts = counter['counts']
+        data_freqs = counter['frequencies']
         
         return data_lst, data_cnts, data_freqs
         
@@ -93,13 +130,14 @@ class DataExploration(object):
         fname = f"{grpX}_by_{grpY}_condhist"
         # xx = ('product_text' if grpX.find("Product")>-1 else "retailer")
         # yy = "category"
+        # word counts per category in one pass, plotted as precomputed bars
+        # of the n most common words instead of every word occurrence
         data_ = {}
-        for dx in data: 
-            if dx['category'] in data_:
-                data_[dx['category']].extend(dx['product_text'].split(" "))
-            else:
-                
-                data_.update({dx['category']: dx['product_text'].split(" ")})
+        for dx in data:
+            cnt = data_.get(dx['category'])
+            if cnt is None:
+                cnt = data_[dx['category']] = Counter()
+            cnt.update(dx['product_text'].split(" "))
         
         # fig = make_subplots(rows=2, cols=2, shared_yaxes='all', shared_xaxes='all', 
         #                    specs=[[{"rowspan": 2, "type": "histogram"}, 
@@ -108,17 +146,17 @@ class DataExploration(object):
         fig = go.Figure()
         btns = []
         data_items = list(data_.items())
-        for clx, dat in data_items:
-            cnti = Counter(dat)
+        for clx, cnti in data_items:
             cnttot = sum(cnti.values())
-            cntfreqs = {c: cnti[c]/cnttot for c in cnti}
-            tracex = go.Histogram(x=dat, name=clx + " keywords",
-                                  visible=(True if clx == data_items[0][0]
-                                           else False),
-                                  hovertext=['%s: %s %%' %
-                                             (x, str(round(cntfreqs[x]*100, 4)))
-                                             for x in cntfreqs],
-                                  hoverinfo='text')
+            top = cnti.most_common(n)
+            tracex = go.Bar(x=[w for w, _ in top], y=[c for _, c in top],
+                            name=clx + " keywords",
+                            visible=(True if clx == data_items[0][0]
+                                     else False),
+                            hovertext=['%s: %s %%' %
+                                       (w, str(round(c / cnttot * 100, 4)))
+                                       for w, c in top],
+                            hoverinfo='text')
             
             btnx = {"label": clx, 'method': 'update',
                     "args":[{'visible': [True if clx == tt[0] else False
@@ -208,10 +246,114 @@ class DataExploration(object):
                 except TypeError as err2:
                     raise TypeError("'fnames' must be iterable", err2)
                 else:
-                    cls.plots2html(fig=figs[f], fname=fname,
-                                   html_kwargs=kwargs.get("html_kwargs", {}))
+                    cls.plot2html(figs[f], fname,
+                                  **kwargs.get("html_kwargs", {}))
 
             if show_:
-                f.show()
+                figs[f].show()
 
-                
+    @classmethod
+    def export(cls, figs, fnames, report='report', fingerprints=None,
+               workers=None, **html_kwargs):
+        # writes every figure into PLOTS_DIR/<report>.html, which loads
+        # plotly.js once (inline, 'cdn' or 'directory'). figures are
+        # rendered to html fragments in a process pool and kept under
+        # PLOTS_DIR/fragments/<report>, along with a manifest of their
+        # fingerprints. a figure whose fingerprint matches the manifest
+        # reuses its fragment. fingerprints are the caller's
+        # (e.g. fingerprint() of the input rows plus the chart options), or
+        # else a hash of the figure json, and either way cover the html
+        # options too. returns the names re-rendered
+        incl_plotly = html_kwargs.pop("include_plotlyjs", True)
+        if incl_plotly not in (True, False, 'cdn', 'directory'):
+            raise ValueError("include_plotlyjs must be True, False, 'cdn' "
+                             "or 'directory', got %r" % (incl_plotly,))
+        opts = {'default_height': html_kwargs.pop('height', '750px'),
+                'default_width': html_kwargs.pop('width', '80%')}
+        opts.update(html_kwargs)
+        if len(fnames) != len(figs):
+            raise IndexError("Insufficient filenames specified")
+        fingerprints = list(fingerprints or [None] * len(figs))
+
+        # fragments belong to the report whose manifest vouches for them
+        frag_dir = os.path.join(PLOTS_DIR, 'fragments', report)
+        os.makedirs(frag_dir, exist_ok=True)
+        manifest_path = os.path.join(PLOTS_DIR, '%s_manifest.json' % report)
+        manifest = {}
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, mode='r') as f:
+                manifest = json.load(f)
+
+        def fragment_path(fname):
+            return os.path.join(frag_dir, '%s.html' % fname)
+
+        # hashed here rather than in the workers, a pickled figure
+        # serializes its template in another key order
+        tasks = []
+        for fig, fname, fp in zip(figs, fnames, fingerprints):
+            if fp is None:
+                fp = _figure_fingerprint(fig)
+            fp = _options_fingerprint(fp, opts)
+            old = manifest.get(fname) if \
+                os.path.isfile(fragment_path(fname)) else None
+            if fp != old:
+                tasks.append((fig, fname, fp, opts))
+
+        rendered = []
+        if workers and workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_render_fragment, tasks))
+        else:
+            results = [_render_fragment(t) for t in tasks]
+        for fname, fp, html in results:
+            with open(fragment_path(fname), mode='w') as f:
+                f.write(html)
+            rendered.append(fname)
+            manifest[fname] = fp
+
+        report_path = os.path.join(PLOTS_DIR, '%s.html' % report)
+        if incl_plotly == 'cdn':
+            head = '<script src="https://cdn.plot.ly/plotly-%s.min.js">' \
+                   '</script>' % plotly_version
+        elif incl_plotly == 'directory':
+            js_path = os.path.join(PLOTS_DIR, 'plotly.min.js')
+            if not os.path.isfile(js_path):
+                with open(js_path, mode='w', encoding='utf-8') as f:
+                    f.write(get_plotlyjs())
+            head = '<script src="plotly.min.js"></script>'
+        elif incl_plotly:
+            head = '<script type="text/javascript">%s</script>' % \
+                get_plotlyjs()
+        else:
+            head = ''
+        with open(report_path, mode='w', encoding='utf-8') as out:
+            out.write('<html>\n<head><meta charset="utf-8" />%s</head>'
+                      '\n<body>\n' % head)
+            for fname in fnames:
+                with open(fragment_path(fname), mode='r') as f:
+                    out.write(f.read())
+                out.write('\n')
+            out.write('</body>\n</html>\n')
+
+        with open(manifest_path, mode='w') as f:
+            json.dump(manifest, f, indent=2)
+        return rendered
+
+
+def _figure_fingerprint(fig):
+    body = json.dumps(fig.to_plotly_json(), sort_keys=True,
+                      cls=PlotlyJSONEncoder)
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def _options_fingerprint(fp, opts):
+    body = json.dumps([fp, opts], sort_keys=True, default=str)
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def _render_fragment(args):
+    # -> (fname, fingerprint, html div)
+    fig, fname, fp, opts = args
+    html = io.to_html(fig, full_html=False, include_plotlyjs=False,
+                      div_id=fname, **opts)
+    return fname, fp, html
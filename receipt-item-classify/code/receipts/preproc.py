@@ -1,29 +1,48 @@
 from receipts import DATA_DIR
 from receipts.enc import Encoders
+from receipts.columns import (ArrayColumn, CategoryColumn, StringColumn,
+                              Table)
+from receipts.similarity import EditDistance, HammingIndex
 from mypyutils import itertoolsx as it
 
 from sklearn.model_selection import train_test_split
 import os
+import re
+import heapq
 from collections import Counter
-from random import seed, choices
-from statistics import mean
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from operator import itemgetter
 import csv
-from nltk.metrics.distance import edit_distance
-from scipy.spatial.distance import hamming
 import pprint
 import numpy as np
 
 
 class Data:
+    RETAILER_STRINGS = ['kkroger', 'kkroer', 'kkr0er', 'kr0ger',
+                        'kkroge', 'kroger', 'kkrog', 'koger',
+                        'kkroe', 'kroer', 'roger', 'oger', 'kkro',
+                        'kroe', 'koer', 'krgr', "krog", 'kro',
+                        'kkr ', 'kgr', 'kr0', 'kr ',
+                        'ppublix', 'publix', "ppublx", 'publx', 'publ',
+                        'ppub', 'pubx', 'pblx', 'pbl',
+                        'pub', 'plx', 'pbx', 'safeway',
+                        'safewy', 'safwy', 'sfwy', 'sfy',
+                        'sfw', 'swy']
+    FIELDS = ['id', 'product_text', 'retailer', 'category']
 
     def __init__(self, f):
         self._f = f
         self.data = []
-        self.X = []
-        self.y = []
+        self.X = Table()
+        self.y = CategoryColumn()
         self.train_x, self.train_y = [], []
         self.test_x, self.test_y = [], []
         self.encoders = Encoders()
+        self._retailer_rank = {rx: i for i, rx in
+                               enumerate(self.RETAILER_STRINGS)}
+        self._retailer_rx = re.compile("(?=(%s))" % "|".join(
+            re.escape(rx) for rx in self.RETAILER_STRINGS))
         
     def head(self, n):
         return self.data[:n]
@@ -34,170 +53,282 @@ class Data:
     def load(self):
         data_path = os.path.join(DATA_DIR, self._f)
 
-        readr = csv.DictReader(open(data_path, mode='r'), 
-                               fieldnames=['id', 'product_text', 'retailer',
-                                           'category'])
-        next(readr)
-        for row in readr:
-            self.data.append({k: row[k].lower().strip() for k in row})
-
-    def set_xy(self, xvars=("product_text")):
-        for d in self.data:
-            self.y.append(d['category'])
-            xrow = []
-            for x in xvars:
-                if x == 'product_text':
-                    v = self._clean_product_text(d[x])
-                elif x == 'id':
-                    v = int(d[x])
-                else:
-                    v = d[x]
-                xrow.append(v)
-            self.X.append(xrow)
+        with open(data_path, mode='r') as f:
+            readr = csv.DictReader(f, fieldnames=self.FIELDS)
+            next(readr)
+            for row in readr:
+                self.data.append({k: row[k].lower().strip() for k in row})
+
+    def iter_chunks(self, chunk_size=65536, columns=None, clean=True,
+                    as_numpy=False):
+        # streams the file as {column: values} chunks of up to chunk_size
+        # rows without keeping anything else in memory. with clean the
+        # product text is cleaned and ids parsed as set_xy does, with
+        # as_numpy every column comes as an ndarray instead of a list
+        columns = list(columns or self.FIELDS)
+        idx = [self.FIELDS.index(c) for c in columns]
+        data_path = os.path.join(DATA_DIR, self._f)
+        with open(data_path, mode='r', newline='') as f:
+            readr = csv.reader(f)
+            next(readr, None)
+            # blank lines come through as [], load() skips them too
+            rows_ = (r for r in readr if r)
+            while True:
+                rows = list(islice(rows_, chunk_size))
+                if not rows:
+                    break
+                if any(len(r) < len(self.FIELDS) for r in rows):
+                    raise ValueError("Rows in %s must have %d fields, "
+                                     "found a shorter one near line %d" %
+                                     (self._f, len(self.FIELDS),
+                                      readr.line_num))
+                chunk = {}
+                for c, i in zip(columns, idx):
+                    col = [r[i].lower().strip() for r in rows]
+                    if clean and c == 'product_text':
+                        col = self.clean_product_text(col)
+                    elif clean and c == 'id':
+                        col = [int(v) for v in col]
+                    chunk[c] = np.array(col) if as_numpy else col
+                yield chunk
+
+    def set_xy(self, xvars=("product_text",)):
+        if isinstance(xvars, str):
+            xvars = (xvars,)
+        columns = []
+        for x in xvars:
+            col = [d[x] for d in self.data]
+            if x == 'product_text':
+                col = self.clean_product_text(col)
+            elif x == 'id':
+                col = [int(v) for v in col]
+            columns.append(col)
+        self.y.extend(d['category'] for d in self.data)
+        if len(self.X):
+            self.X.extend(zip(*columns))
+        else:
+            self.X = Table(xvars, [self._column(x, col) for x, col
+                                   in zip(xvars, columns)])
             
     def _clean_product_text(self, x):
-        retailer_strings = ['kkroger', 'kkroer', 'kkr0er', 'kr0ger',
-                            'kkroge', 'kroger', 'kkrog', 'koger', 
-                            'kkroe', 'kroer','roger', 'oger', 'kkro', 
-                            'kroe', 'koer', 'krgr', "krog", 'kro', 
-                            'kkr ', 'kgr', 'kr0', 'kr ',
-                            'ppublix', 'publix',  "ppublx", 'publx', 'publ', 
-                            'ppub', 'pubx', 'pblx', 'pbl', 
-                            'pub', 'plx', 'pbx', 'safeway',
-                            'safewy', 'safwy', 'sfwy', 'sfy',
-                            'sfw', 'swy']
-        for rx in retailer_strings:
-            if x.find(rx) > -1:
-                return self._clean_product_text(x.replace(rx, "").strip())
-            else:
-                pass
+        # strips the first of RETAILER_STRINGS found in x, then starts over
+        # on what is left. one regex scan lists every retailer string in x
+        # (at each position the alternation picks the earliest in the list)
+        found = self._retailer_rx.findall(x)
+        while found:
+            rx = min(found, key=self._retailer_rank.__getitem__)
+            x = x.replace(rx, "").strip()
+            found = self._retailer_rx.findall(x)
         return x
 
-    
+    @staticmethod
+    def _column(name, values):
+        if name == 'product_text':
+            return StringColumn(values)
+        elif name == 'id':
+            return ArrayColumn(values)
+        return CategoryColumn(values)
+
+    def clean_product_text(self, values):
+        # cleans a whole column, each distinct value once
+        cleaned = {}
+        out = []
+        for v in values:
+            c = cleaned.get(v)
+            if c is None:
+                c = cleaned[v] = self._clean_product_text(v)
+            out.append(c)
+        return out
+
+    @staticmethod
+    def _draw_strings(points, pool_starts, pool_sizes, n_chars, rng):
+        # string i gets n_chars[i] code points drawn uniformly from
+        # points[pool_starts[i]:pool_starts[i] + pool_sizes[i]], which
+        # weights every char by how often it occurs in that pool
+        offsets = np.zeros(n_chars.size + 1, dtype=np.int64)
+        np.cumsum(n_chars, out=offsets[1:])
+        owner = np.repeat(np.arange(n_chars.size), n_chars)
+        pick = pool_starts[owner] + (rng.random(offsets[-1]) *
+                                     pool_sizes[owner]).astype(np.int64)
+        return StringColumn.from_codepoints(points[pick], offsets)
+
     @staticmethod
     def generate_pad(x, n, char_wts, random=None):
-        seed(random)
-        pad = []
-        if char_wts:
-            chars = []
-            lengths = []
-            for xi in x:
-                chars.extend(list(xi[1]))
-                lengths.append(len(xi[1]))
-            char_freqs = {elem: chars.count(elem)/float(len(chars)) 
-                          for elem in set(chars)}
-            mean_size = mean(lengths)
-            for i in range(n):
-                new_chars = choices(list(set(chars)), 
-                                    weights=char_freqs, k=mean_size)
-                new_string = "".join(new_chars)
-                pad.append(new_string)
-                
-        else:
-            pad.extend(choices([i[0] for i in x], k=n))
-        return pad
-
-    def pad_classes(self, min_size, cls_counts=None, use_char_wts=False):
-        if not cls_counts:
-            cls_counts = Counter(self.y)
-
-        small_classes = {k: cls_counts[k] for k in cls_counts 
-                         if cls_counts[k] < min_size}
-        for clx in small_classes:
-            try:
-                ff = np.array([idx for idx in range(len(self.y)) 
-                               if self.y[idx] == clx])
-                xvals = np.array(self.X)[ff]
-            except IndexError:
-                raise IndexError("Whoops something went wrong")
-            else:
-                n_cls = min_size - small_classes[clx]
-                pad = Data.generate_pad(x=xvals, n=n_cls, char_wts=use_char_wts)
-                self.X.extend([p for p in pad])
-                self.y.extend([clx for _ in pad])
+        # n new strings for one class: resampled from x, or with char_wts
+        # random strings of the mean length over the chars of x
+        rng = np.random.default_rng(random)
+        col = x if isinstance(x, StringColumn) else StringColumn(x)
+        if not char_wts:
+            return col.take(rng.integers(0, len(col), n)).tolist()
+        points, offsets = col.codepoints()
+        size = int(round(offsets[-1] / len(col)))
+        return Data._draw_strings(points, np.zeros(n, dtype=np.int64),
+                                  np.full(n, points.size),
+                                  np.full(n, size), rng).tolist()
+
+    def _text_column(self):
+        if 'product_text' in self.X.names:
+            return self.X.names.index('product_text')
+        for i, col in enumerate(self.X.columns):
+            if isinstance(col, StringColumn):
+                return i
+        raise ValueError("X has no text column to draw chars from")
+
+    def pad_classes(self, min_size, cls_counts=None, use_char_wts=False,
+                    random=None):
+        # oversamples every class with fewer than min_size rows in one go:
+        # pad rows copy random rows of their class, with use_char_wts their
+        # text is replaced by random strings drawn from the class' chars
+        rng = np.random.default_rng(random)
+        codes, categories = self.y.codes, self.y.categories
+        have = np.bincount(codes, minlength=len(categories))
+        counts = have if not cls_counts else \
+            np.array([cls_counts.get(c, 0) for c in categories])
+        need = np.where(have > 0, np.maximum(min_size - counts, 0), 0)
+        if not need.any():
+            return
+
+        # rows sorted by class, class c owns order[starts[c]:ends[c]]
+        order = np.argsort(codes, kind='stable')
+        ends = np.cumsum(have)
+        starts = ends - have
+        pad_cls = np.repeat(np.arange(need.size), need)
+        src = order[starts[pad_cls] + rng.integers(0, have[pad_cls])]
+        pad = self.X.take(src)
+        if use_char_wts:
+            ti = self._text_column()
+            points, offsets = self.X.columns[ti].take(order).codepoints()
+            pool_starts = offsets[starts]
+            pool_sizes = offsets[ends] - pool_starts
+            n_chars = np.rint(pool_sizes / np.maximum(have, 1)) \
+                .astype(np.int64)
+            pad.columns[ti] = self._draw_strings(
+                points, pool_starts[pad_cls], pool_sizes[pad_cls],
+                n_chars[pad_cls], rng)
+        self.X.append(pad)
+        self.y.append(self.y.take(src))
     
     def split_data(self, train_sz, test_sz=None, rand_state=None):
         # output format - train_x, test_x, train_y, test_y
-        self.train_x, self.test_x, self.train_y, self.test_y = train_test_split(self.X, self.y, train_size=train_sz)
+        # only row numbers are split, the columns are gathered once per set
+        train_idx, test_idx = train_test_split(
+            np.arange(len(self.y)), train_size=train_sz, test_size=test_sz,
+            random_state=rand_state)
+        self.train_x, self.test_x = self.X.take(train_idx), self.X.take(test_idx)
+        self.train_y, self.test_y = self.y.take(train_idx), self.y.take(test_idx)
         stmt = "{setx} are not equal x: {x_set} != y: {y_set}"
         assert (len(self.train_x)==len(self.train_y)), stmt.format(setx='train', x_set=len(self.train_x), y_set=len(self.train_y))
         assert (len(self.test_x)==len(self.test_y)), stmt.format(setx='train', x_set=len(self.train_x), y_set=len(self.train_y))
         print("all sets are equal")
     
-class Utils:
-    pp = pprint.PrettyPrinter(indent=2)
+def _count_chunk(args):
+    groups, rows = args
+    return CounterEngine(groups).update(rows)
 
-    
-    @classmethod
-    def _create_counter(cls, data, name, top_n=None):
-        cnt = Counter(data)
-        cnt_lst = [(k, cnt[k]) for k in cnt]
 
-        freqs = it.relative_freq(data, float_prec=10, as_=list)
-        cnt = sorted(cnt_lst, key=lambda x: x[1], reverse=True)
+class CounterEngine:
+    # the Utils.counters groups, all counted in one pass over the rows.
+    # engines over separate chunks can be merged, groups limits the work
+    # to the named counters
+    NAMES = ['Product Text (Parts)', 'Product Text (Split)',
+             'Product Text (Chars)', "Retailers", 'Categories']
 
-        if top_n is not None and top_n < len(freqs):
-            freqs = freqs[:top_n]
-            cnt = cnt[:top_n]
-            data = [d for d in data if d in freqs]
+    def __init__(self, groups=None):
+        groups = list(groups or self.NAMES)
+        for g in groups:
+            if g not in self.NAMES:
+                raise KeyError(f"Invalid group name {g}. "
+                               f"Not found in {self.NAMES}")
+        self.groups = groups
+        self.counters = {g: Counter() for g in groups}
 
+    def update(self, rows):
+        parts, split, chars, rets, cats = (self.counters.get(g) for g
+                                           in self.NAMES)
+        for d in rows:
+            text = d['product_text']
+            if parts is not None:
+                parts.update(it.partition_string(text.replace(" ", ""), 5))
+            if split is not None:
+                split.update(text.split(" "))
+            if chars is not None:
+                chars.update(text)
+            if rets is not None:
+                rets[d['retailer']] += 1
+            if cats is not None:
+                cats[d['category']] += 1
+        return self
 
-        return {'counts': dict(cnt), 'frequencies': dict(freqs), 
+    def merge(self, other):
+        for g, cnt in other.counters.items():
+            if g in self.counters:
+                self.counters[g].update(cnt)
+            else:
+                self.groups.append(g)
+                self.counters[g] = Counter(cnt)
+        return self
+
+    @classmethod
+    def from_chunks(cls, chunks, groups=None, workers=1):
+        engine = cls(groups)
+        if workers and workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for part in pool.map(_count_chunk, ((engine.groups, c)
+                                                    for c in chunks)):
+                    engine.merge(part)
+        else:
+            for c in chunks:
+                engine.update(c)
+        return engine
+
+    def result(self, name, top_n=None):
+        # same dict as Utils._create_counter. 'data' lists the kept values
+        # once per occurrence, most common first
+        cnt = self.counters[name]
+        total = sum(cnt.values())
+        if top_n is not None and top_n < len(cnt):
+            top = heapq.nlargest(top_n, cnt.items(), key=itemgetter(1))
+        else:
+            top = sorted(cnt.items(), key=itemgetter(1), reverse=True)
+        freqs = [(k, round(v / total, 10)) for k, v in top]
+        data = [k for k, v in top for _ in range(v)]
+        return {'counts': dict(top), 'frequencies': dict(freqs),
                 'data': data, 'name': name}
 
+
+class Utils:
+    pp = pprint.PrettyPrinter(indent=2)
+
     @classmethod
-    def counters(cls, data, top_n):
-        pt_part, pt_split, pt_chars = [], [], []
-        rets, cats = [], []
-        names_idx = ['Product Text (Parts)', 'Product Text (Split)', 
-                     'Product Text (Chars)', "Retailers", 'Categories']
-        for d in data:
-            pt_part.append(it.partition_string(d['product_text']
-                                               .replace(" ", ""), 5))
-
-            pt_split.append(d['product_text'].split(" "))
-            pt_chars.append(list(d['product_text']))
-            rets.append(d['retailer'])
-            cats.append(d['category'])
-        ptcnt_part = cls._create_counter(it.flatten_nested_list(pt_part), 
-                                         name='Product Text (Parts)',
-                                         top_n=top_n)
-        ptcnt_split = cls._create_counter(it.flatten_nested_list(pt_split),
-                                          name='Product Text (Split)',
-                                          top_n=top_n)
-        ptcnt_chars = cls._create_counter(it.flatten_nested_list(pt_chars),
-                                          name='Product Text (Chars)',
-                                          top_n=top_n)
-        retcnt = cls._create_counter(rets, name="Retailers", top_n=top_n)
-        catcnt = cls._create_counter(cats, name='Categories', top_n=top_n) 
-
-        return {"name_idx": names_idx, 
-                "counters": [ptcnt_part, ptcnt_split, 
-                             ptcnt_chars, retcnt, catcnt]}
+    def counters(cls, data, top_n, workers=1, chunk_size=65536):
+        if workers and workers > 1:
+            rows = iter(data)
+            chunks = iter(lambda: list(islice(rows, chunk_size)), [])
+            engine = CounterEngine.from_chunks(chunks, workers=workers)
+        else:
+            engine = CounterEngine().update(data)
+        names_idx = list(CounterEngine.NAMES)
+        return {"name_idx": names_idx,
+                "counters": [engine.result(name, top_n=top_n)
+                             for name in names_idx]}
 
     @classmethod
-    def string_distances(cls, strings):
-        pcts = []
-        for string1 in strings:
-            pcts_1 = []
-            for string2 in strings:
-                dist = edit_distance(string1, string2)
-                lrgr = max(len(string1), len(string2))
-                pct = (lrgr - dist) / lrgr
-                pcts_1.append(round(pct, 3))
-            pcts.append(pcts_1)
-        cls.pp.pprint(pcts)
+    def string_distances(cls, strings, max_distance=None, workers=1):
+        # (longest - edit distance) / longest for every pair of strings
+        engine = EditDistance(strings, max_distance=max_distance,
+                              workers=workers)
+        pcts = np.round(engine.similarity(), 3)
+        cls.pp.pprint(pcts.tolist())
+        return pcts
 
     @classmethod
-    def encoded_distances(cls, arrs):
-        pcts = []
-        for arr1 in arrs:
-            pcts_1 = []
-            for arr2 in arrs:
-                dist = hamming(arr1, arr2)
-                pcts_1.append(round(dist, 3))
-            pcts.append(pcts_1)
-        cls.pp.pprint(pcts)
+    def encoded_distances(cls, arrs, n_bits=None):
+        # same fractions as scipy's hamming over every pair of rows, from
+        # one popcount pass over the packed rows. n_bits for packed input
+        index = HammingIndex(np.asarray(arrs), n_bits=n_bits)
+        pcts = np.round(index.pairwise() / index.n_positions, 3)
+        cls.pp.pprint(pcts.tolist())
+        return pcts
 
     @staticmethod
     def generate_sample(data, size, outfile=None, save=True):
@@ -0,0 +1,416 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(words):
+    # set bits per row of a 2d uint64 array
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    return POPCOUNT[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+class HammingIndex:
+    # nearest neighbour index over encoded rows. rows are either the
+    # Encoder's packed uint8 rows (pass n_bits) or dense rows of values;
+    # 0/1 rows are packed as they are, rows with more values (e.g. the pad
+    # value) are one hot encoded so every differing position costs exactly
+    # two bits. rows are kept as uint64 words and compared by popcount of
+    # their XOR. with n_tables > 0 the words are also split into that many
+    # byte substrings, each hashed in a table (multi-index hashing): any row
+    # closer than n_tables bits matches a query exactly in one substring, so
+    # those are found without scanning the whole index.
+    def __init__(self, rows, n_bits=None, n_tables=0):
+        rows = np.asarray(rows)
+        if rows.ndim != 2:
+            raise ValueError("Rows must be a 2d array")
+        self._values = None
+        self._scale = 1
+        self._packed = n_bits is not None
+        if self._packed:
+            if rows.dtype != np.uint8:
+                raise ValueError("Packed rows must be uint8")
+            self.n_positions = n_bits
+        else:
+            self.n_positions = rows.shape[1]
+            values = np.unique(rows)
+            if not np.isin(values, (0, 1)).all():
+                self._values = values
+                self._scale = 2
+        self._n_bytes = None
+        self._words = self._to_words(rows)
+        self._tables = []
+        self._build_tables(n_tables)
+
+    def _to_words(self, rows):
+        rows = np.asarray(rows)
+        if rows.ndim == 1:
+            rows = rows[None, :]
+        if not self._packed:
+            if self._values is not None:
+                idx = np.searchsorted(self._values, rows)
+                idx = np.minimum(idx, self._values.size - 1)
+                known = self._values[idx] == rows
+                rows = np.zeros(rows.shape + (self._values.size,),
+                                dtype=np.uint8)
+                np.put_along_axis(rows, idx[..., None],
+                                  known[..., None].astype(np.uint8), axis=-1)
+                rows = rows.reshape(rows.shape[0], -1)
+            packed = np.packbits(rows.astype(np.uint8), axis=1)
+        else:
+            packed = rows
+        if self._n_bytes is None:
+            self._n_bytes = packed.shape[1]
+        elif packed.shape[1] != self._n_bytes:
+            raise ValueError("Rows must have %d bytes, got %d" %
+                             (self._n_bytes, packed.shape[1]))
+        n_words = (self._n_bytes + 7) // 8
+        buf = np.zeros((packed.shape[0], n_words * 8), dtype=np.uint8)
+        buf[:, :packed.shape[1]] = packed
+        return buf.view(np.uint64)
+
+    def _build_tables(self, n_tables):
+        n_bytes = self._words.shape[1] * 8
+        n_tables = min(n_tables, n_bytes)
+        self._tables = []
+        if n_tables <= 0:
+            return
+        buf = self._words.view(np.uint8)
+        bounds = np.linspace(0, n_bytes, n_tables + 1).astype(int)
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            keys = np.ascontiguousarray(buf[:, lo:hi]).view('V%d' % (hi - lo))
+            uniq, inverse = np.unique(keys.ravel(), return_inverse=True)
+            order = np.argsort(inverse, kind='stable')
+            splits = np.cumsum(np.bincount(inverse, minlength=uniq.size))[:-1]
+            table = {u.tobytes(): ids for u, ids in
+                     zip(uniq, np.split(order, splits))}
+            self._tables.append((lo, hi, table))
+
+    def __len__(self):
+        return self._words.shape[0]
+
+    def distances(self, q):
+        # differing positions between q and every row in the index
+        return popcount(self._words ^ self._to_words(q)) // self._scale
+
+    def _candidates(self, words):
+        buf = words.view(np.uint8)
+        found = [table.get(buf[0, lo:hi].tobytes()) for lo, hi, table
+                 in self._tables]
+        found = [ids for ids in found if ids is not None]
+        if sum(ids.size for ids in found) > len(self) // 4:
+            # common substrings (e.g. all padding) select most of the
+            # index, a plain scan is cheaper then
+            return None
+        hit = np.zeros(len(self), dtype=bool)
+        for ids in found:
+            hit[ids] = True
+        return np.flatnonzero(hit)
+
+    @staticmethod
+    def _top_k(ids, dists, k):
+        if dists.size > k:
+            keep = dists <= np.partition(dists, k - 1)[k - 1]
+            ids, dists = ids[keep], dists[keep]
+        order = np.lexsort((ids, dists))[:k]
+        return ids[order], dists[order]
+
+    def _query_one(self, words, k, max_distance):
+        ids = self._candidates(words) if self._tables else None
+        if ids is not None:
+            dists = popcount(self._words[ids] ^ words) // self._scale
+            # rows missing from the candidates differ in every substring,
+            # i.e. by at least len(tables) bits
+            limit = len(self._tables) // self._scale
+            close = dists < limit
+            if close.sum() >= k or (max_distance is not None and
+                                    max_distance < limit):
+                keep = close if max_distance is None else \
+                    close & (dists <= max_distance)
+                return self._top_k(ids[keep], dists[keep], k)
+
+        dists = popcount(self._words ^ words) // self._scale
+        ids = np.arange(dists.size)
+        if max_distance is not None:
+            keep = dists <= max_distance
+            ids, dists = ids[keep], dists[keep]
+        return self._top_k(ids, dists, k)
+
+    def query(self, q, k=1, max_distance=None):
+        # k nearest rows of the index for each row of q as (ids, distances),
+        # closest first (ties by id). a single 1d query gives 1d arrays, with
+        # max_distance fewer than k rows can come back
+        q = np.asarray(q)
+        single = q.ndim == 1
+        words = self._to_words(q)
+        k = min(k, len(self))
+        results = [self._query_one(words[i:i + 1], k, max_distance)
+                   for i in range(words.shape[0])]
+        if single:
+            return results[0]
+        return [r[0] for r in results], [r[1] for r in results]
+
+    def pairwise(self, block_size=None):
+        # all pairs distance matrix, computed a block of rows at a time
+        n, n_words = self._words.shape
+        block_size = block_size or max(1, (1 << 22) // max(1, n * n_words))
+        dists = np.zeros((n, n), dtype=np.int64)
+        for lo in range(0, n, block_size):
+            block = self._words[lo:lo + block_size]
+            dists[lo:lo + block.shape[0]] = popcount(
+                block[:, None, :] ^ self._words[None, :, :])
+        return dists // self._scale
+
+
+def levenshtein(a, b):
+    # Myers' bit-parallel edit distance, one python int bit per char of a
+    m = len(a)
+    if m == 0:
+        return len(b)
+    peq = {}
+    for i, c in enumerate(a):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    mask, high = (1 << m) - 1, 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    for c in b:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+    return score
+
+
+_worker_engine = None
+
+
+def _init_worker(engine):
+    global _worker_engine
+    _worker_engine = engine
+
+
+def _run_block(args):
+    lo, hi, col_lo = args
+    return lo, _worker_engine._block(lo, hi, col_lo)
+
+
+class EditDistance:
+    # all pairs levenshtein distances between strings. strings are sorted by
+    # length and turned into alphabet ids, then a block of up to 64 char
+    # patterns is run against every longer string at once with Myers'
+    # algorithm on uint64 words, one numpy step per text character. the few
+    # strings longer than 64 chars are paired with each other in python.
+    # with max_distance the block stops once every pair is known to be
+    # further apart, and those pairs come back as max_distance + 1
+    WORD_BITS = 64
+
+    def __init__(self, strings, max_distance=None, workers=1, block_size=64):
+        self.strings = list(strings)
+        self.max_distance = max_distance
+        self.workers = workers
+        self.block_size = block_size
+
+        lengths = np.array([len(s) for s in self.strings], dtype=np.int64)
+        self._order = np.argsort(lengths, kind='stable')
+        self._lengths = lengths[self._order]
+        n = len(self.strings)
+        text = "".join(self.strings[i] for i in self._order)
+        points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        alphabet, ids = np.unique(points, return_inverse=True)
+        ids = ids.ravel().astype(np.min_scalar_type(alphabet.size))
+        self._n_alpha = alphabet.size
+        self._n_short = int(np.searchsorted(self._lengths, self.WORD_BITS,
+                                            side='right'))
+        # strings of up to 64 chars as rows of alphabet ids, unused cells get
+        # the id one past the alphabet, which matches nothing. longer strings
+        # stay flat in _long_text so an outlier does not widen every row
+        starts = np.cumsum(self._lengths) - self._lengths
+        short = self._lengths[:self._n_short]
+        width = int(short.max(initial=0))
+        self._text = np.full((self._n_short, width), alphabet.size,
+                             dtype=ids.dtype)
+        rows = np.repeat(np.arange(self._n_short), short)
+        cols = np.arange(rows.size) - np.repeat(starts[:self._n_short],
+                                                short)
+        self._text[rows, cols] = ids[:rows.size]
+        self._long_text = ids[rows.size:]
+        self._long_starts = starts[self._n_short:] - rows.size
+
+    def __len__(self):
+        return len(self.strings)
+
+    def _column(self, lo, hi, j):
+        # alphabet ids at position j of the sorted strings lo:hi, which are
+        # all longer than j
+        parts = []
+        if lo < self._n_short:
+            parts.append(self._text[lo:min(hi, self._n_short), j])
+        if hi > self._n_short:
+            starts = self._long_starts[max(lo, self._n_short) -
+                                       self._n_short:hi - self._n_short]
+            parts.append(self._long_text[starts + j])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def _block(self, lo, hi, col_lo, col_hi=None):
+        # distances of sorted patterns lo:hi (all <= 64 chars) against the
+        # sorted strings col_lo:col_hi, as a (hi - lo, col_hi - col_lo) array
+        lengths = self._lengths
+        n = lengths.size
+        col_hi = n if col_hi is None else col_hi
+        m = lengths[lo:hi]
+        n_rows, n_cols = hi - lo, col_hi - col_lo
+        peq = np.zeros((n_rows, self._n_alpha + 1), dtype=np.uint64)
+        for k in range(int(m.max(initial=0))):
+            live = m > k
+            np.bitwise_or.at(peq, (np.flatnonzero(live),
+                                   self._text[lo:hi][live, k]),
+                             np.uint64(1 << k))
+
+        row_idx = np.arange(n_rows)[:, None]
+        one = np.uint64(1)
+        high = (one << (np.maximum(m, 1).astype(np.uint64) - one))[:, None]
+        cutoff = self.max_distance
+        if cutoff is not None and col_hi == n:
+            # strings more than cutoff chars longer than every pattern are
+            # too far apart from all of them, only the rest is computed
+            stop = int(np.searchsorted(lengths, int(m.max(initial=0)) +
+                                       cutoff, side='right'))
+            if stop < n:
+                score = np.full((n_rows, n_cols), cutoff + 1, dtype=np.int64)
+                stop = max(stop, col_lo)
+                score[:, :stop - col_lo] = self._block(lo, hi, col_lo, stop)
+                return score
+        pv = np.full((n_rows, n_cols), ~np.uint64(0), dtype=np.uint64)
+        mv = np.zeros((n_rows, n_cols), dtype=np.uint64)
+        score = np.repeat(m[:, None], n_cols, axis=1)
+        col_len = lengths[col_lo:col_hi]
+        steps = int(col_len.max(initial=0))
+        for j in range(steps):
+            # strings are sorted, so the ones still running are a suffix
+            a = int(np.searchsorted(col_len, j, side='right'))
+            if a >= n_cols:
+                break
+            pv_a, mv_a = pv[:, a:], mv[:, a:]
+            eq = peq[row_idx, self._column(col_lo + a, col_hi, j)[None, :]]
+            xv = eq | mv_a
+            xh = (((eq & pv_a) + pv_a) ^ pv_a) | eq
+            ph = mv_a | ~(xh | pv_a)
+            mh = pv_a & xh
+            score[:, a:] += (ph & high != 0).astype(np.int64)
+            score[:, a:] -= (mh & high != 0).astype(np.int64)
+            ph = (ph << one) | one
+            mh = mh << one
+            pv[:, a:] = mh | ~(xv | ph)
+            mv[:, a:] = ph & xv
+            if cutoff is not None and j % 8 == 7:
+                # a distance drops by at most one per remaining character
+                rest = col_len[a:] - (j + 1)
+                if (score[:, a:] - rest > cutoff).all():
+                    score[:, a:] = cutoff + 1
+                    break
+        # empty patterns are as far from a string as it is long
+        score[m == 0] = col_len
+        if cutoff is not None:
+            np.minimum(score, cutoff + 1, out=score)
+        return score
+
+    def _blocks(self, full_rows):
+        bounds = list(range(0, self._n_short, self.block_size)) + \
+            [self._n_short]
+        tasks = [(lo, hi, 0 if full_rows else lo)
+                 for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+        if self.workers and self.workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     initializer=_init_worker,
+                                     initargs=(self,)) as pool:
+                for lo, block in pool.map(_run_block, tasks):
+                    yield lo, block
+        else:
+            for lo, hi, col_lo in tasks:
+                yield lo, self._block(lo, hi, col_lo)
+
+    def _long_pairs(self, full_rows):
+        # pairs of strings that are both longer than 64 chars
+        n, cutoff = len(self), self.max_distance
+        for i in range(self._n_short, n):
+            a = self.strings[self._order[i]]
+            for j in range(self._n_short if full_rows else i, n):
+                d = levenshtein(a, self.strings[self._order[j]])
+                if cutoff is not None:
+                    d = min(d, cutoff + 1)
+                yield i, j, d
+
+    def distances(self):
+        n = len(self)
+        dtype = np.int16 if self._lengths.max(initial=0) < (1 << 15) \
+            else np.int32
+        out = np.zeros((n, n), dtype=dtype)
+        order = self._order
+        for lo, block in self._blocks(full_rows=False):
+            rows = order[lo:lo + block.shape[0]]
+            cols = order[lo:]
+            out[np.ix_(rows, cols)] = block
+            out[np.ix_(cols, rows)] = block.T
+        for i, j, d in self._long_pairs(full_rows=False):
+            out[order[i], order[j]] = out[order[j], order[i]] = d
+        return out
+
+    def _similarity(self, dists, len_a, len_b):
+        # (longest - distance) / longest as in Utils.string_distances, two
+        # empty strings are identical and pairs past max_distance get 0
+        longest = np.maximum(len_a, len_b)
+        sims = np.ones(dists.shape, dtype=np.float64)
+        np.divide(longest - dists, longest, out=sims, where=longest > 0)
+        if self.max_distance is not None:
+            sims[dists > self.max_distance] = 0.0
+        return sims
+
+    def similarity(self):
+        lengths = np.array([len(s) for s in self.strings], dtype=np.int64)
+        return self._similarity(self.distances(), lengths[:, None],
+                                lengths[None, :])
+
+    def top_k(self, k):
+        # the k most similar other strings for every string, as (ids, sims)
+        # arrays of shape (n, k), most similar first (ties by id). rows are
+        # computed a block at a time and never held as a full matrix
+        n = len(self)
+        k = min(k, n - 1)
+        ids = np.zeros((n, max(k, 0)), dtype=np.int64)
+        sims = np.zeros((n, max(k, 0)), dtype=np.float64)
+        if k <= 0:
+            return ids, sims
+        order, lengths = self._order, self._lengths
+
+        def keep(rows, block):
+            block = self._similarity(block, lengths[rows][:, None],
+                                     lengths[None, :])
+            cols = np.broadcast_to(order[None, :], block.shape)
+            block[np.arange(rows.size), rows] = -1.0
+            top = np.lexsort((cols, -block), axis=1)[:, :k]
+            ids[order[rows]] = np.take_along_axis(cols, top, axis=1)
+            sims[order[rows]] = np.take_along_axis(block, top, axis=1)
+
+        for lo, block in self._blocks(full_rows=True):
+            keep(np.arange(lo, lo + block.shape[0]), block)
+        if self._n_short < n:
+            long_rows = np.arange(self._n_short, n)
+            block = np.zeros((long_rows.size, n), dtype=np.int64)
+            for i in long_rows:
+                a = self.strings[order[i]]
+                block[i - self._n_short] = [
+                    levenshtein(a, self.strings[order[j]]) for j in range(n)]
+            if self.max_distance is not None:
+                np.minimum(block, self.max_distance + 1, out=block)
+            keep(long_rows, block)
+        return ids, sims